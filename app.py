@@ -2,16 +2,28 @@
 Speech-to-TextとLLMを連携させるStreamlitアプリケーション
 """
 import os
+import re
+import html
+import json
+import unicodedata
 import time
+import asyncio
 import threading
 import queue
 import logging
+import logging.handlers
+from collections import OrderedDict, deque
 from typing import List, Tuple
 
 import streamlit as st
 from dotenv import load_dotenv
 import traceback  # トレースバック情報を出力するために追加
 
+try:
+    import orjson  # 状態ファイルの高速なシリアライズに使用
+except ImportError:
+    orjson = None  # orjsonが無い環境では標準ライブラリのjsonにフォールバック
+
 from speech_to_text import SpeechToTextStreaming
 from llm_manager import LLMManager
 
@@ -20,7 +32,8 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("app.log"),
+        # ログファイルはローテーションで上限を設ける（末尾読みの対象サイズも一定に保たれる）
+        logging.handlers.RotatingFileHandler("app.log", maxBytes=1_000_000, backupCount=3),
         logging.StreamHandler()
     ]
 )
@@ -29,22 +42,55 @@ logger = logging.getLogger(__name__)
 # 環境変数の読み込み
 load_dotenv()
 
+# ターン判定と並行して本応答を投機的に生成するかどうか
+# （レイテンシは下がるが、会話継続と判定された場合は生成したトークンが無駄になる。
+#  コストを優先する場合はSPECULATIVE_RESPONSE=0で無効化できる）
+_SPECULATIVE_RESPONSE = os.getenv("SPECULATIVE_RESPONSE", "1").lower() not in ("0", "false")
+
 # グローバル変数（スレッド間で共有）
 _is_listening = False
 _transcript_queue = queue.Queue()
+_STOP_SENTINEL = object()  # stop_listeningがキューに積む停止マーカー（ブロッキングgetを即時に起こす）
+_worker_loop = None  # ワーカースレッドで動くasyncioループ（他スレッドからのcall_soon_threadsafe用）
+_async_queue = None  # ワーカーループ上のasyncio.Queue（文字起こしの受け渡し用）
 _llm_manager = None  # LLMマネージャーをグローバル変数として保持
 _transcripts = []  # 文字起こしを保存するグローバル変数
 _responses = []  # 応答を保存するグローバル変数
 _current_transcript = ""  # 現在の文字起こしを保存するグローバル変数
-_current_response = ""  # 現在生成中のLLM応答を保存するグローバル変数
-_update_ui = False  # UIの更新フラグ
-_last_ui_update_time = time.time()  # 最後にUIを更新した時間
-_force_update = False  # 強制更新フラグ
+_current_response_parts: List[str] = []  # 現在生成中のLLM応答（チャンクのリストとして保持）
+_current_response_cache = ("", 0)  # 結合済み文字列と、その時点でのパーツ数
+
+def _get_current_response() -> str:
+    """
+    現在生成中のLLM応答を文字列として取得する
+
+    UIの更新ごとに呼ばれるため、前回の読み取り以降パーツが増えていなければ
+    結合済みの文字列をそのまま返す（再結合しない）。
+    """
+    global _current_response_cache
+
+    cached, count = _current_response_cache
+    if count == len(_current_response_parts):
+        return cached
+    joined = "".join(_current_response_parts)
+    _current_response_cache = (joined, len(_current_response_parts))
+    return joined
 _is_generating = False  # LLM応答生成中フラグ
 _accumulated_context = ""  # Global variable to accumulate short-turn transcripts
+# LLMプロンプト用の会話履歴（ターンごとに追記するだけで再構築しない）
+# maxlenで直近のターンに限定し、会話が長くなってもプロンプト構築と
+# 送信トークン数がO(K)で頭打ちになるようにする。全履歴はアーカイブファイルに残る
+_HISTORY_WINDOW = 32
+_history_parts: "deque[str]" = deque(maxlen=_HISTORY_WINDOW)
 
 # ファイルベースの状態保存
 _STATE_FILE = "app_state.json"
+_ARCHIVE_FILE = "app_archive.jsonl"  # 全会話ターンの追記専用アーカイブ（1ターン=1行）
+_state_file_mtime = 0.0  # 最後に読み込んだ状態ファイルのmtime（不要な再読み込みを防ぐ）
+_state_dirty = False  # 未保存の変更があるかどうか
+_SAVE_INTERVAL = 0.5  # 状態保存の最小間隔（秒）
+_save_event = threading.Event()  # 保存待ちの変更があることをライタースレッドに通知
+_state_writer_thread = None  # バックグラウンドの状態書き込みスレッド
 
 # セッション状態の初期化
 if "stt" not in st.session_state:
@@ -121,6 +167,49 @@ TURN_DETECTION_PROMPT = """
 
 # グローバル変数の定義
 _state_lock = threading.RLock()  # スレッドセーフな操作のためのロック
+_state_event = threading.Event()  # ワーカースレッドが状態を更新したことをUIスレッドに通知
+
+# 質問検出用の正規表現（ヒューリスティック判定で使用。マーカーごとのin検索を1回の走査にまとめる）
+_Q_RE = re.compile(r'[?？]|何|どう|なぜ|いつ|どこ|だれ|誰|ですか')
+
+# フィラー（つなぎ言葉）の発言。常に会話継続なのでターン判定LLMを呼ぶ必要がない
+_FILLERS = frozenset({"はい", "うん", "ええ", "そう", "そうですね", "えーと", "あー", "なるほど"})
+
+# 言いさし（接続助詞などで終わり、続きが予想される）発言の語尾と、返す相槌。
+# 短い発言の大半はこのテーブルで判定でき、ターン判定LLMの往復を丸ごと省略できる
+_CONTINUATION_ENDINGS = ("けど", "けれど", "ので", "から", "それで", "でも", "とか", "たり", "って", "まして", "していて")
+_CONTINUATION_ACK = "ええ"
+_CONTINUATION_MAX_LEN = 20  # 長い発言は語尾だけで判断せずLLMに回す
+
+# ターン判定応答の解析用正規表現（ホットパスで毎回コンパイルしないよう事前コンパイル）
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+_CONTINUE_RE = re.compile(r'"continueConversation"\s*:\s*(true|false)')
+_ACK_RE = re.compile(r'"acknowledgement"\s*:\s*"([^"]+)"')
+
+# ターン判定結果（直近10件のみ保持）。deque.appendはCPythonではアトミックなので、
+# ワーカースレッドの追記とUIスレッドの読み取りにロックは不要。maxlenが
+# pop(0)によるO(N)シフトも置き換える
+_turn_results: "deque[dict]" = deque(maxlen=10)
+
+# ターン判定結果のキャッシュ（「はい」「うん」などの繰り返し発言でLLM呼び出しを省略）
+_turn_cache: "OrderedDict[str, Tuple[bool, str]]" = OrderedDict()
+_TURN_CACHE_MAX_SIZE = 512
+
+def _turn_cache_key(transcript: str) -> str:
+    """ターン判定キャッシュのキーを正規化する（NFKC + 小文字化）
+
+    全角/半角やカタカナの互換文字の揺れでキャッシュミスしないようにする。
+    """
+    return unicodedata.normalize("NFKC", transcript.strip()).lower()
+
+def _is_obvious_question(transcript: str) -> bool:
+    """
+    明確な質問かどうかをヒューリスティックで判定する
+
+    質問が検出された場合はターン判定の結果に関わらず会話完了として扱うため、
+    このケースではターン判定LLMを呼び出す必要がない。
+    """
+    return _Q_RE.search(transcript) is not None
 
 # 実験的な機能を有効化
 st.set_page_config(
@@ -137,6 +226,12 @@ st.set_page_config(
 if "update_frequency" not in st.session_state:
     st.session_state.update_frequency = 0.1  # 100ミリ秒ごとに更新
 
+def _reset_current_response():
+    """生成中応答のバッファと結合キャッシュをまとめてリセットする"""
+    global _current_response_cache
+    _current_response_parts.clear()
+    _current_response_cache = ("", 0)
+
 def initialize_stt():
     """
     Speech-to-Textの初期化
@@ -188,8 +283,8 @@ def on_speech_result(transcript: str, is_final: bool):
         transcript: 認識されたテキスト
         is_final: 最終結果かどうか
     """
-    global _transcript_queue, _current_transcript, _update_ui, _last_ui_update_time
-    
+    global _transcript_queue, _current_transcript
+
     # 現在の文字起こしを更新
     _current_transcript = transcript
     
@@ -197,72 +292,165 @@ def on_speech_result(transcript: str, is_final: bool):
     if is_final:
         logger.info(f"音声認識結果（最終）: {transcript}")
     else:
-        logger.debug(f"音声認識結果（中間）: {transcript}")
+        logger.debug("音声認識結果（中間）: %s", transcript)
     
-    # 最終結果の場合はキューに追加
+    # 最終結果の場合はワーカーのキューに追加
     if is_final and transcript.strip():
-        _transcript_queue.put(transcript)
-        _update_ui = True  # UIの更新フラグをセット
-        _last_ui_update_time = time.time()  # 最後の更新時間を記録
+        _enqueue_transcript(transcript)
+        _state_event.set()  # UIスレッドに更新を通知
+
+# LLMストリーミングチャンクのバッチ処理用バッファ
+# （トークンごとに文字列連結とUI更新フラグ操作を行わないため）
+_stream_buffer: List[str] = []
+_stream_last_flush = 0.0
+_STREAM_FLUSH_INTERVAL = 0.05  # フラッシュの最小間隔（秒）
+_STREAM_FLUSH_CHUNKS = 20  # この数を超えたら間隔に関係なくフラッシュ
 
 def on_llm_stream(chunk: str):
     """
     LLMからのストリーミング応答を処理するコールバック関数
-    
+
+    チャンクはバッファに溜め、一定間隔または一定数ごとにまとめて反映する。
+    空のチャンクを渡すと強制的にフラッシュされる（ストリーム終了時用）。
+
     Args:
         chunk: LLMからのテキストチャンク
     """
-    global _current_response, _update_ui, _last_ui_update_time, _force_update, _is_generating
-    
+    global _stream_last_flush
+
     if chunk:
-        _current_response += chunk
-        _update_ui = True
-        _last_ui_update_time = time.time()
-        
-        try:
-            # このスレッドからセッション状態を更新
-            st.session_state.current_response = _current_response
-            # 強制更新要求
-            _force_update = True
-        except Exception as e:
-            # セッション状態へのアクセスエラーは無視（別スレッドからのアクセスで発生する可能性あり）
-            logger.warning(f"ストリーミングコールバックでセッション状態の更新中にエラー: {str(e)}")
-            pass
-    
-    logger.debug(f"LLMストリーミング: {chunk}")  # 詳細なログ
+        _stream_buffer.append(chunk)
+
+    now = time.monotonic()
+    should_flush = _stream_buffer and (
+        not chunk  # 空チャンク＝強制フラッシュ
+        or now - _stream_last_flush > _STREAM_FLUSH_INTERVAL
+        or len(_stream_buffer) >= _STREAM_FLUSH_CHUNKS
+    )
+    if should_flush:
+        joined = "".join(_stream_buffer)
+        _stream_buffer.clear()
+        _stream_last_flush = now
+
+        _current_response_parts.append(joined)
+        _state_event.set()
+
+        # セッション状態はメインスレッドのupdate_session_stateが取り込む
+        # （別スレッドからのst.session_stateアクセスはStreamlit非対応）
+
+        # %sによる遅延フォーマット（DEBUG無効時は文字列を構築しない）
+        logger.debug("LLMストリーミング: %s", joined)
 
 def _save_state():
-    """状態をファイルに保存"""
+    """状態をファイルに保存（一時ファイルに書いてからリネームするアトミック書き込み）"""
     state = {
         "transcripts": _transcripts,
         "responses": _responses,
         "current_transcript": _current_transcript,
-        "current_response": _current_response,
-        "turn_detection_results": st.session_state.get("turn_detection_results", [])  # 追加
+        "current_response": _get_current_response(),
+        "turn_detection_results": list(_turn_results)
     }
-    
-    with open(_STATE_FILE, "w", encoding="utf-8") as f:
-        import json
-        json.dump(state, f, ensure_ascii=False, indent=2)
+
+    if orjson is not None:
+        data = orjson.dumps(state)
+    else:
+        data = json.dumps(state, ensure_ascii=False).encode("utf-8")
+
+    # UIスレッドが書き込み途中のファイルを読まないよう、書き込み後にリネームする
+    tmp_file = _STATE_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+    os.replace(tmp_file, _STATE_FILE)
+
+def _archive_turn(transcript: str, response: str):
+    """
+    完了したターンをアーカイブファイルに1行追記する
+
+    プロンプト用の履歴は直近のターンに限定されるため、全履歴はこの
+    追記専用JSONLに残す。追記のみなのでターンごとのコストはO(1)。
+    """
+    try:
+        record = {"transcript": transcript, "response": response, "timestamp": time.time()}
+        if orjson is not None:
+            line = orjson.dumps(record) + b"\n"
+        else:
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(_ARCHIVE_FILE, "ab") as f:
+            f.write(line)
+    except Exception as e:
+        logger.error(f"会話アーカイブの書き込み中にエラーが発生しました: {str(e)}")
+
+def _state_writer_loop():
+    """
+    バックグラウンドで状態ファイルを書き込むループ（デーモンスレッド）
+
+    変更フラグが立つのを待ち、_SAVE_INTERVAL秒のあいだ後続の変更を
+    まとめてから1回だけ書き込む。これによりシリアライズとファイルI/Oが
+    文字起こし処理のホットパスから完全に外れる。
+    """
+    global _state_dirty
+
+    while True:
+        _save_event.wait()
+        time.sleep(_SAVE_INTERVAL)  # 連続した変更を1回の書き込みにまとめる
+        _save_event.clear()
+        try:
+            with _state_lock:
+                state_dirty = _state_dirty
+                _state_dirty = False
+            if state_dirty:
+                _save_state()
+        except Exception as e:
+            logger.error(f"状態の保存中にエラーが発生しました: {str(e)}")
+
+def _save_state_debounced():
+    """
+    状態保存をバックグラウンドのライタースレッドに依頼する
+
+    process_transcriptsのホットパスから毎ターン呼ばれるため、ここでは
+    フラグを立てて通知するだけにし、実際の書き込みは行わない。
+    未保存の変更はstop_listening時にもフラッシュされる。
+    """
+    global _state_dirty, _state_writer_thread
+
+    _state_dirty = True
+    if _state_writer_thread is None or not _state_writer_thread.is_alive():
+        _state_writer_thread = threading.Thread(target=_state_writer_loop, daemon=True)
+        _state_writer_thread.start()
+    _save_event.set()
 
 def _load_state():
-    """ファイルから状態を読み込む"""
-    import json  # jsonモジュールをここでインポート
-    
+    """ファイルから状態を読み込む（mtimeが変わっていない場合は再読み込みしない）"""
+    global _state_file_mtime, _transcripts, _responses, _current_transcript
+
     if os.path.exists(_STATE_FILE):
         try:
-            with open(_STATE_FILE, "r", encoding="utf-8") as f:
-                state = json.load(f)
-            
+            # mtimeが前回読み込み時と同じならJSON解析をスキップ
+            mtime = os.path.getmtime(_STATE_FILE)
+            if mtime == _state_file_mtime:
+                return _transcripts, _responses
+
+            with open(_STATE_FILE, "rb") as f:
+                data = f.read()
+            state = orjson.loads(data) if orjson is not None else json.loads(data)
+            _state_file_mtime = mtime
+
             # 既存の状態を読み込む
             _transcripts = state.get("transcripts", [])
             _responses = state.get("responses", [])
+            # プロンプト用の履歴を復元分から構築し直す（以降はターンごとの追記のみ）
+            _history_parts.clear()
+            for i in range(min(len(_transcripts), len(_responses))):
+                _history_parts.append(f"ユーザー: {_transcripts[i]}\nAI: {_responses[i]}\n")
             _current_transcript = state.get("current_transcript", "")
-            _current_response = state.get("current_response", "")
+            _reset_current_response()
+            if state.get("current_response"):
+                _current_response_parts.append(state["current_response"])
             
             # ターン判定結果の読み込み
             if "turn_detection_results" in state:
-                st.session_state.turn_detection_results = state["turn_detection_results"]
+                _turn_results.clear()
+                _turn_results.extend(state["turn_detection_results"])
             
             logger.info(f"ファイルから状態を読み込みました。転記数: {len(_transcripts)}, 応答数: {len(_responses)}")
             return _transcripts, _responses
@@ -271,135 +459,258 @@ def _load_state():
     
     return [], []
 
-def process_transcripts():
+def _enqueue_transcript(item):
     """
-    音声認識結果を処理するスレッド関数
+    文字起こし（または停止センチネル）をワーカーに渡す
+
+    ワーカーのasyncioループが動いていればcall_soon_threadsafeで直接
+    asyncio.Queueに積み、スレッド間のポーリングやエグゼキュータ経由の
+    ブロッキングgetを挟まずにワーカーを起こす。ループ起動前の分は
+    スレッドキューに溜めておき、ループ開始時に取り込まれる。
     """
-    global _is_listening, _transcript_queue, _llm_manager, _transcripts, _responses, _update_ui, _last_ui_update_time, _force_update, _current_response, _is_generating, _accumulated_context
-    
-    logger.info("文字起こし処理スレッドを開始します。")
-    import json
-    import re
-    
+    loop = _worker_loop
+    if loop is not None and _async_queue is not None and loop.is_running():
+        loop.call_soon_threadsafe(_async_queue.put_nowait, item)
+    else:
+        _transcript_queue.put(item)
+
+def _classify_turn_fast(transcript):
+    """
+    LLMを呼ばずにターン判定できる場合はその結果を返す
+
+    Returns:
+        tuple: (会話継続か, 相槌, LLMの生応答) / 判定できない場合はNone
+    """
+    # 明確な質問はヒューリスティックで即座に会話完了と判定し、
+    # ターン判定LLMの呼び出し（ネットワーク往復）を省略する
+    if _is_obvious_question(transcript):
+        logger.info("質問検出によりターン判定LLMをスキップ: 会話完了")
+        return False, "はい", ""
+
+    # よくあるフィラー発言は常に会話継続なのでLLMを呼ばない
+    stripped = transcript.strip().rstrip("。、…")
+    if stripped in _FILLERS:
+        logger.info("フィラー検出によりターン判定LLMをスキップ: 会話継続")
+        return True, "はい", ""
+
+    # 言いさし語尾で終わる短い発言は続きがあるとみなし、テーブルの相槌を即返す
+    if len(stripped) <= _CONTINUATION_MAX_LEN and stripped.endswith(_CONTINUATION_ENDINGS):
+        logger.info("言いさし語尾検出によりターン判定LLMをスキップ: 会話継続")
+        return True, _CONTINUATION_ACK, ""
+
+    # 同一発言のターン判定はキャッシュから再利用する
+    cache_key = _turn_cache_key(transcript)
+    if cache_key in _turn_cache:
+        _turn_cache.move_to_end(cache_key)
+        continue_conversation, ack = _turn_cache[cache_key]
+        logger.info(f"ターン判定キャッシュヒット: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
+        return continue_conversation, ack, ""
+
+    return None
+
+def _classify_turn_llm(transcript):
+    """
+    ターン判定LLMを呼び出して判定する（ブロッキング）
+
+    判定に必要なのはcontinueConversationの真偽値だけなので、応答を
+    ストリーミングで受け取り、その値が読めた時点で受信を打ち切る。
+    完全なJSONの生成完了を待たないぶん、判定レイテンシが初回トークン
+    付近まで短縮される。
+
+    Returns:
+        tuple: (会話継続か, 相槌, LLMの生応答)
+    """
+    received: List[str] = []
+
+    def _on_turn_chunk(chunk: str):
+        received.append(chunk)
+        # continueConversationが読めたらストリーミングを打ち切る
+        # （相槌はJSONの後方にあるため、届いていなければデフォルト値を使う）
+        if _CONTINUE_RE.search("".join(received)):
+            return False
+        return True
+
+    turn_response = _llm_manager.call_model(
+        prompt=transcript,
+        system_prompt=TURN_DETECTION_PROMPT,
+        model="gemini-2.0-flash-lite",
+        stream=True,
+        stream_callback=_on_turn_chunk
+    )
+    logger.info(f"ターン判定結果: {turn_response}")
+
+    # 途中で打ち切った場合も、parse_turn_decisionの正規表現バックアップが
+    # 部分的なJSONからcontinueConversation（と可能なら相槌）を抽出する
+    continue_conversation, ack = parse_turn_decision(turn_response, transcript)
+    logger.info(f"解析結果: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
+
+    # 判定結果をキャッシュに保存（サイズ上限を超えたら古いものから削除）
+    _turn_cache[_turn_cache_key(transcript)] = (continue_conversation, ack)
+    if len(_turn_cache) > _TURN_CACHE_MAX_SIZE:
+        _turn_cache.popitem(last=False)
+
+    return continue_conversation, ack, turn_response
+
+def _generate_full_response(transcript):
+    """会話履歴を含めた本応答をLLMで生成する（ブロッキング）"""
+    # 会話履歴は毎ターン全体を組み立て直さず、追記済みのリストを結合するだけにする
+    # （ターンが進むほどプロンプト構築がO(N^2)になるのを防ぐ。
+    #  プレフィックスが毎回同一になるため、プロバイダ側のプロンプトキャッシュも効きやすい）
+    current_context = f"{''.join(_history_parts)}ユーザー: {transcript}\nAI: "
+
+    return _llm_manager.call_model(
+        prompt=current_context,
+        system_prompt=CONVERSATION_SYSTEM_PROMPT,
+        model="gemini-2.0-flash-lite",
+        stream=False
+    )
+
+async def _process_transcripts_async():
+    """
+    音声認識結果を処理する非同期ループ
+
+    ターン判定LLMが必要な場合は、本応答の生成を投機的に並行開始し、
+    判定結果が「会話完了」ならそのまま採用することで、判定と生成の
+    ネットワーク往復を直列ではなく重ねて実行する。
+    """
+    global _is_generating, _current_transcript
+    global _worker_loop, _async_queue
+
+    loop = asyncio.get_running_loop()
+    _worker_loop = loop
+    _async_queue = asyncio.Queue()
+
+    # ループ起動前にスレッドキューへ溜まっていた文字起こしを取り込む
+    while True:
+        try:
+            _async_queue.put_nowait(_transcript_queue.get_nowait())
+        except queue.Empty:
+            break
+
     while _is_listening:
         try:
-            if not _transcript_queue.empty():
-                # 文字起こしを取得した後
-                transcript = _transcript_queue.get(timeout=0.1)
-                logger.info(f"キューから取得した文字起こし: {transcript}")
-                
-                # グローバル変数に保存（これはスレッドセーフ）
-                global _current_transcript
-                _current_transcript = transcript
-                
-                # LLMを使用してターン判定
-                turn_response = _llm_manager.call_model(
-                    prompt=transcript,
-                    system_prompt=TURN_DETECTION_PROMPT,
-                    model="gemini-2.0-flash-lite",
-                    stream=False
+            try:
+                transcript = await asyncio.wait_for(_async_queue.get(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if transcript is _STOP_SENTINEL:
+                # stop_listeningからの停止指示。タイムアウト待ちせず即座に終了する
+                break
+
+            logger.info(f"キューから取得した文字起こし: {transcript}")
+            _current_transcript = transcript
+
+            fast_result = _classify_turn_fast(transcript)
+            speculative = None
+            if fast_result is not None:
+                continue_conversation, ack, turn_response = fast_result
+            else:
+                # 投機的に本応答の生成を開始しつつ、ターン判定を並行実行する
+                if _SPECULATIVE_RESPONSE:
+                    speculative = loop.run_in_executor(None, _generate_full_response, transcript)
+                continue_conversation, ack, turn_response = await loop.run_in_executor(
+                    None, _classify_turn_llm, transcript
                 )
-                logger.info(f"ターン判定結果: {turn_response}")
-                
-                # 改善されたJSONパーサーを使用
-                continue_conversation, ack = parse_turn_decision(turn_response, transcript)
-                logger.info(f"解析結果: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
-                
-                # 判定結果をセッション状態に保存
-                turn_result = {
-                    "transcript": transcript,
-                    "continue_conversation": continue_conversation,
-                    "acknowledgement": ack,
-                    "raw_response": turn_response,
-                    "timestamp": time.time()
-                }
-                
-                # スレッドセーフに状態を更新
+
+            # 判定結果をセッション状態に保存
+            turn_result = {
+                "transcript": transcript,
+                "continue_conversation": continue_conversation,
+                "acknowledgement": ack,
+                "raw_response": turn_response,
+                "timestamp": time.time()
+            }
+
+            # dequeのappendはアトミックなのでロックなしで追加できる
+            # （maxlen超過分は自動で押し出される）
+            _turn_results.append(turn_result)
+            _save_state_debounced()  # 状態を保存（デバウンス付き）
+
+            # 会話状態の更新と応答処理
+            if continue_conversation:
+                # 会話継続の場合は相槌を返す（投機的生成の結果は破棄）
+                if speculative is not None:
+                    speculative.cancel()
+                logger.info(f"会話継続と判断: 相槌=\"{ack}\"")
+
+                # 相槌を表示するだけで、LLM応答は生成しない
                 with _state_lock:
-                    # 最大10件まで保存
-                    if "turn_detection_results" not in st.session_state:
-                        st.session_state.turn_detection_results = []
-                    
-                    if len(st.session_state.turn_detection_results) >= 10:
-                        st.session_state.turn_detection_results.pop(0)
-                    st.session_state.turn_detection_results.append(turn_result)
-                    _save_state()  # 状態を保存
-                
-                # 会話状態の更新と応答処理
-                if continue_conversation:
-                    # 会話継続の場合は相槌を返す
-                    logger.info(f"会話継続と判断: 相槌=\"{ack}\"")
-                    
-                    # 相槌を表示するだけで、LLM応答は生成しない
+                    _current_transcript = transcript
+                    _reset_current_response()
+                    _current_response_parts.append(ack)
+                _state_event.set()
+            else:
+                # 会話完了の場合はLLM応答を生成（投機的生成があればそれを待つ）
+                logger.info("会話完了と判断: 応答生成開始")
+                _is_generating = True
+
+                try:
+                    if speculative is not None:
+                        response_text = await speculative
+                    else:
+                        response_text = await loop.run_in_executor(
+                            None, _generate_full_response, transcript
+                        )
+
+                    logger.info(f"LLM応答生成完了: {response_text[:100]}...")
+
+                    # 応答を保存
                     with _state_lock:
+                        _transcripts.append(transcript)
+                        _responses.append(response_text)
+                        _history_parts.append(f"ユーザー: {transcript}\nAI: {response_text}\n")
+                        _archive_turn(transcript, response_text)
                         _current_transcript = transcript
-                        _current_response = ack
-                        _update_ui = True
-                        _last_ui_update_time = time.time()
-                else:
-                    # 会話完了の場合はLLM応答を生成
-                    logger.info("会話完了と判断: 応答生成開始")
-                    _is_generating = True
-                    
-                    try:
-                        # LLM応答の生成
-                        response_text = ""
-                        
-                        # 会話履歴を構築
-                        conversation_history = ""
-                        for i in range(min(len(_transcripts), len(_responses))):
-                            conversation_history += f"ユーザー: {_transcripts[i]}\nAI: {_responses[i]}\n"
-                        
-                        # 現在の会話コンテキストを追加
-                        current_context = f"{conversation_history}ユーザー: {transcript}\nAI: "
-                        
-                        # LLM応答の生成（モデル名を修正）
-                        response_text = _llm_manager.call_model(
-                            prompt=current_context,
-                            system_prompt=CONVERSATION_SYSTEM_PROMPT,
-                            model="gemini-2.0-flash-lite", 
-                            stream=False
-                        )
-                        
-                        logger.info(f"LLM応答生成完了: {response_text[:100]}...")
-                        
-                        # 応答を保存
-                        with _state_lock:
-                            _transcripts.append(transcript)
-                            _responses.append(response_text)
-                            _current_transcript = transcript
-                            _current_response = response_text
-                            _update_ui = True
-                            _force_update = True
-                            _last_ui_update_time = time.time()
-                            _save_state()
-                    except Exception as e:
-                        logger.error(f"LLM応答生成中にエラーが発生しました: {str(e)}")
-                        logger.error(str(e))
-                        traceback.print_exc()
-                    finally:
-                        _is_generating = False
+                        _reset_current_response()
+                        _current_response_parts.append(response_text)
+                        _save_state_debounced()
+                    _state_event.set()
+                except Exception as e:
+                    logger.error(f"LLM応答生成中にエラーが発生しました: {str(e)}")
+                    logger.error(str(e))
+                    traceback.print_exc()
+                finally:
+                    _is_generating = False
         except Exception as e:
             logger.error(f"文字起こしの処理中にエラーが発生しました: {str(e)}")
             logger.error(str(e))
             traceback.print_exc()
-        
-        time.sleep(0.1)  # CPUの使用率を下げるために短いスリープ
+
+    # ループ終了後は他スレッドからの参照を外す（以降はスレッドキューに溜まる）
+    _worker_loop = None
+    _async_queue = None
+
+def process_transcripts():
+    """
+    音声認識結果を処理するスレッド関数（専用スレッド上でasyncioループを実行）
+    """
+    logger.info("文字起こし処理スレッドを開始します。")
+    asyncio.run(_process_transcripts_async())
 
 def parse_turn_decision(turn_response, transcript):
     """
     LLMを主体としたターン判定解析器（ヒューリスティックはバックアップのみ）
     """
-    import json
-    import re
-    
     # デフォルト値
     continue_conversation = True
     ack = "なるほど"
-    
+
+    # 0. 純粋なJSONの場合はそのまま解析する（プロンプトがJSONのみを指示しているため通常ケース）
+    # startswithで先に判別し、JSONでない応答に例外コストを払わないようにする
+    stripped_response = turn_response.strip()
+    if stripped_response.startswith("{"):
+        try:
+            turn_data = json.loads(stripped_response)
+            continue_conversation = turn_data.get("continueConversation", True)
+            ack = turn_data.get("acknowledgement", "なるほど")
+            logger.info(f"LLM判定を使用: {continue_conversation}")
+            return continue_conversation, ack
+        except ValueError:
+            pass  # 部分的なJSONなどは以降の抽出処理に回す
+
     # 1. LLM応答からJSONを直接解析（メイン方法）
     try:
-        json_match = re.search(r'\{.*\}', turn_response, re.DOTALL)
+        json_match = _JSON_RE.search(turn_response)
         if json_match:
             json_str = json_match.group(0)
             turn_data = json.loads(json_str)
@@ -412,8 +723,8 @@ def parse_turn_decision(turn_response, transcript):
     
     # 2. 正規表現で個別フィールド抽出（バックアップ1）
     try:
-        continue_match = re.search(r'"continueConversation"\s*:\s*(true|false)', turn_response)
-        ack_match = re.search(r'"acknowledgement"\s*:\s*"([^"]+)"', turn_response)
+        continue_match = _CONTINUE_RE.search(turn_response)
+        ack_match = _ACK_RE.search(turn_response)
         
         if continue_match:
             continue_conversation = continue_match.group(1).lower() == "true"
@@ -438,7 +749,7 @@ def parse_turn_decision(turn_response, transcript):
         logger.info("応答テキスト内の'false'に基づき会話完了と判定")
     
     # 最後に質問検出だけはオーバーライド（重要なケース）
-    if "?" in transcript or "？" in transcript or any(q in transcript for q in ["何", "どう", "なぜ", "いつ", "どこ", "だれ", "誰", "ですか"]):
+    if _is_obvious_question(transcript):
         continue_conversation = False
         logger.info("質問検出によるオーバーライド: 会話完了")
     
@@ -488,8 +799,8 @@ def stop_listening():
     """
     音声認識を停止する
     """
-    global _is_listening
-    
+    global _is_listening, _state_dirty
+
     if not st.session_state.is_listening:
         logger.info("音声認識はすでに停止しています。")
         return
@@ -502,24 +813,33 @@ def stop_listening():
     
     st.session_state.is_listening = False
     _is_listening = False
-    
+
+    # キュー待ちのワーカースレッドを即座に起こして終了させる
+    _enqueue_transcript(_STOP_SENTINEL)
+
     # スレッドが終了するのを待機
     if st.session_state.response_thread and st.session_state.response_thread.is_alive():
         logger.info("文字起こし処理スレッドの終了を待機します。")
         st.session_state.response_thread.join(timeout=1.0)
-    
+
+    # デバウンスで保留されていた変更をフラッシュ
+    if _state_dirty:
+        _save_state()
+        _state_dirty = False
+
     logger.info("音声認識を停止しました。")
 
 def clear_history():
     """
     会話履歴をクリアする
     """
-    global _transcript_queue, _transcripts, _responses, _current_transcript, _update_ui, _accumulated_context
+    global _transcript_queue, _transcripts, _responses, _current_transcript, _accumulated_context
     
     logger.info("会話履歴をクリアします。")
     
     _transcripts = []
     _responses = []
+    _history_parts.clear()  # プロンプト用の履歴もクリア
     _current_transcript = ""
     _accumulated_context = ""  # 蓄積コンテキストもクリア
     
@@ -534,37 +854,116 @@ def clear_history():
     
     # ファイルに状態を保存
     _save_state()
-    
-    _update_ui = True
-    
+
+    _state_event.set()
+
     logger.info("会話履歴をクリアしました。")
 
 def update_session_state():
     """
     グローバル変数からセッション状態を更新する
     """
-    global _transcripts, _responses, _current_transcript, _current_response, _force_update, _is_generating
-    
-    logger.info(f"セッション状態を更新します。転記数: {len(_transcripts)}, 応答数: {len(_responses)}")
+    global _transcripts, _responses, _current_transcript, _is_generating
+
+    # 自動更新のたびに呼ばれるため、通常運用でログが毎秒数行増えないようdebugに落とす
+    logger.debug("セッション状態を更新します。転記数: %d, 応答数: %d", len(_transcripts), len(_responses))
     
     # 転記と応答の数が一致しない場合は調整
     if len(_transcripts) > len(_responses):
         logger.warning(f"転記数({len(_transcripts)})が応答数({len(_responses)})より多いです。調整します。")
         _transcripts = _transcripts[:len(_responses)]
-    
-    # ファイルから最新の状態を読み込む
-    _load_state()
-    
-    # セッション状態を更新
-    st.session_state.transcripts = _transcripts.copy()
-    st.session_state.responses = _responses.copy()
-    st.session_state.current_transcript = _current_transcript
-    st.session_state.current_response = _current_response
-    st.session_state.is_generating = _is_generating
-    st.session_state.last_update_time = time.time()
-    _force_update = False
-    
-    logger.info(f"セッション状態を更新しました。st.session_state.transcripts: {len(st.session_state.transcripts)}, st.session_state.responses: {len(st.session_state.responses)}")
+
+    # ワーカースレッドと共有しているグローバル状態をロック下でコピーする
+    # （ファイル経由のIPCは不要。ファイルはクラッシュリカバリ用にのみ保存される）
+    with _state_lock:
+        # 履歴リストは追記のみなので、全コピーではなく新しいペアだけを取り込む
+        pair_count = min(len(_transcripts), len(_responses))
+        synced = st.session_state.get("synced_pairs", 0)
+        if pair_count < synced:
+            # 履歴クリアなどで縮んだ場合は同期し直す
+            st.session_state.transcripts = _transcripts[:pair_count]
+            st.session_state.responses = _responses[:pair_count]
+        elif pair_count > synced:
+            st.session_state.transcripts.extend(_transcripts[synced:pair_count])
+            st.session_state.responses.extend(_responses[synced:pair_count])
+        st.session_state.synced_pairs = pair_count
+        st.session_state.current_transcript = _current_transcript
+        st.session_state.current_response = _get_current_response()
+        st.session_state.turn_detection_results = list(_turn_results)
+        st.session_state.is_generating = _is_generating
+        st.session_state.last_update_time = time.time()
+    _state_event.clear()
+
+    logger.debug(
+        "セッション状態を更新しました。st.session_state.transcripts: %d, st.session_state.responses: %d",
+        len(st.session_state.transcripts), len(st.session_state.responses)
+    )
+
+# 会話履歴保存用のHTMLテンプレート（関数呼び出しごとに構築しない）
+_CONVERSATION_HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>会話履歴</title>
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #f5f5f5;
+        }
+        .chat-container {
+            display: flex;
+            flex-direction: column;
+            gap: 15px;
+        }
+        .message {
+            display: flex;
+            margin-bottom: 10px;
+        }
+        .user-message {
+            justify-content: flex-end;
+        }
+        .ai-message {
+            justify-content: flex-start;
+        }
+        .message-bubble {
+            max-width: 70%;
+            padding: 10px 15px;
+            border-radius: 18px;
+            box-shadow: 0 1px 2px rgba(0,0,0,0.1);
+        }
+        .user-bubble {
+            background-color: #dcf8c6;
+            border-bottom-right-radius: 5px;
+        }
+        .ai-bubble {
+            background-color: #ffffff;
+            border-bottom-left-radius: 5px;
+        }
+        .timestamp {
+            font-size: 0.7em;
+            color: #999;
+            margin-top: 5px;
+            text-align: right;
+        }
+        h1 {
+            text-align: center;
+            color: #333;
+        }
+    </style>
+</head>
+<body>
+    <h1>会話履歴</h1>
+    <div class="chat-container">
+        {chat_content}
+    </div>
+</body>
+</html>
+"""
 
 def save_conversation_to_html():
     """
@@ -577,106 +976,41 @@ def save_conversation_to_html():
         return None
     
     try:
-        # HTMLテンプレート
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>会話履歴</title>
-            <style>
-                body {
-                    font-family: Arial, sans-serif;
-                    max-width: 800px;
-                    margin: 0 auto;
-                    padding: 20px;
-                    background-color: #f5f5f5;
-                }
-                .chat-container {
-                    display: flex;
-                    flex-direction: column;
-                    gap: 15px;
-                }
-                .message {
-                    display: flex;
-                    margin-bottom: 10px;
-                }
-                .user-message {
-                    justify-content: flex-end;
-                }
-                .ai-message {
-                    justify-content: flex-start;
-                }
-                .message-bubble {
-                    max-width: 70%;
-                    padding: 10px 15px;
-                    border-radius: 18px;
-                    box-shadow: 0 1px 2px rgba(0,0,0,0.1);
-                }
-                .user-bubble {
-                    background-color: #dcf8c6;
-                    border-bottom-right-radius: 5px;
-                }
-                .ai-bubble {
-                    background-color: #ffffff;
-                    border-bottom-left-radius: 5px;
-                }
-                .timestamp {
-                    font-size: 0.7em;
-                    color: #999;
-                    margin-top: 5px;
-                    text-align: right;
-                }
-                h1 {
-                    text-align: center;
-                    color: #333;
-                }
-            </style>
-        </head>
-        <body>
-            <h1>会話履歴</h1>
-            <div class="chat-container">
-                {chat_content}
-            </div>
-        </body>
-        </html>
-        """
-        
-        # 会話内容を生成
-        chat_content = ""
+        # 会話内容を生成（+=による文字列連結はO(N^2)になるため、リストに溜めて最後に結合する）
+        chat_parts = []
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        
+
         for i in range(len(_transcripts)):
             # HTMLエスケープ処理
-            user_text = _transcripts[i].replace("<", "&lt;").replace(">", "&gt;")
-            
+            user_text = html.escape(_transcripts[i])
+
             # ユーザーメッセージ
-            chat_content += f"""
+            chat_parts.append(f"""
             <div class="message user-message">
                 <div class="message-bubble user-bubble">
                     <div>{user_text}</div>
                     <div class="timestamp">{timestamp}</div>
                 </div>
             </div>
-            """
-            
+            """)
+
             # AIメッセージ
             if i < len(_responses):
                 # HTMLエスケープ処理
-                ai_text = _responses[i].replace("<", "&lt;").replace(">", "&gt;")
-                
-                chat_content += f"""
+                ai_text = html.escape(_responses[i])
+
+                chat_parts.append(f"""
                 <div class="message ai-message">
                     <div class="message-bubble ai-bubble">
                         <div>{ai_text}</div>
                         <div class="timestamp">{timestamp}</div>
                     </div>
                 </div>
-                """
-        
+                """)
+
         # HTMLを生成
-        html_content = html_template.format(chat_content=chat_content)
+        # CSSの波括弧がstr.formatのフィールド構文と衝突するため、プレースホルダを直接置換する
+        html_content = _CONVERSATION_HTML_TEMPLATE.replace("{chat_content}", "".join(chat_parts))
         
         # ファイル名を生成
         filename = f"conversation_{time.strftime('%Y%m%d_%H%M%S')}.html"
@@ -692,6 +1026,58 @@ def save_conversation_to_html():
         logger.error(error_msg)
         return None
 
+def _render_live_conversation(placeholder):
+    """
+    現在の会話（動的セクション）をプレースホルダーに描画する
+
+    HTMLブロックは1回のmarkdown呼び出しにまとめて、再描画ごとの
+    コンポーネント更新回数を減らす。自動更新時はページ全体を再実行せず、
+    この関数でプレースホルダーだけをインプレース更新する。
+    """
+    parts = []
+
+    if st.session_state.is_listening and st.session_state.turn_detection_results:
+        # 最新のターン判定結果を表示
+        latest_result = st.session_state.turn_detection_results[-1]
+        parts.append(
+            f"""
+            <div style="padding: 10px; border-radius: 5px; background-color: #f0f2f6; margin-bottom: 10px;">
+                <strong>あなた (リアルタイム):</strong> {latest_result["transcript"]}
+            </div>
+            """
+        )
+
+        # 相槌または応答を表示
+        parts.append(
+            f"""
+            <div style="padding: 10px; border-radius: 5px; background-color: #e6f7ff; margin-bottom: 10px;">
+                <strong>AI (リアルタイム):</strong> {latest_result["acknowledgement"]}
+            </div>
+            """
+        )
+
+    # 現在の文字起こしと応答を表示
+    if st.session_state.current_transcript:
+        parts.append(
+            f"""
+            <div style="padding: 10px; border-radius: 5px; background-color: #f0f2f6; margin-bottom: 10px;">
+                <strong>あなた:</strong> {st.session_state.current_transcript}
+            </div>
+            """
+        )
+
+    if st.session_state.current_response:
+        parts.append(
+            f"""
+            <div style="padding: 10px; border-radius: 5px; background-color: #e6f7ff; margin-bottom: 10px;">
+                <strong>AI:</strong> {st.session_state.current_response}
+            </div>
+            """
+        )
+
+    if parts:
+        placeholder.markdown("".join(parts), unsafe_allow_html=True)
+
 def main():
     """
     メイン関数
@@ -715,15 +1101,17 @@ def main():
     if "turn_detection_results" not in st.session_state:
         st.session_state.turn_detection_results = []
     
-    global _transcripts, _responses, _current_transcript, _current_response, _update_ui, _last_ui_update_time, _force_update, _is_generating
+    global _transcripts, _responses, _current_transcript, _is_generating
     
     logger.info("アプリケーションを開始します。")
     
     st.title("🎤 リアルタイム音声会話")
-    
-    # ファイルから状態を読み込む
-    _load_state()
-    
+
+    # 起動時のみファイルから状態を復元する（以降はプロセス内の共有状態を直接参照）
+    if "state_restored" not in st.session_state:
+        _load_state()
+        st.session_state.state_restored = True
+
     # 起動時にグローバル変数からセッション状態を更新
     update_session_state()
     logger.info(f"起動時にセッション状態を更新しました。転記数: {len(st.session_state.transcripts)}, 応答数: {len(st.session_state.responses)}")
@@ -771,7 +1159,7 @@ def main():
         auto_refresh = st.checkbox("自動更新（1秒ごと）", value=True)
         
         # 更新インジケータ
-        if _update_ui:
+        if _state_event.is_set():
             st.success("新しい会話が追加されました！")
         
         st.divider()
@@ -785,9 +1173,14 @@ def main():
         # ログ表示
         st.subheader("ログ")
         if os.path.exists("app.log"):
-            with open("app.log", "r") as f:
-                log_content = f.read()
-                st.text_area("最新のログ", log_content[-5000:], height=200)
+            # ログファイル全体ではなく末尾の表示分だけを読み込む
+            with open("app.log", "rb") as f:
+                try:
+                    f.seek(-5000, os.SEEK_END)
+                except OSError:
+                    f.seek(0)  # ファイルが5000バイト未満の場合
+                log_content = f.read().decode("utf-8", errors="replace")
+            st.text_area("最新のログ", log_content, height=200)
         
         st.divider()
         
@@ -814,55 +1207,17 @@ def main():
     with tab1:
         # リアルタイム会話表示
         st.subheader("現在の会話")
-        
+
         # 録音状態の表示
         if st.session_state.is_listening:
             st.info("🎤 録音中... マイクに向かって話しかけてください")
-            
-            # 最新のターン判定結果があれば表示
-            if "turn_detection_results" in st.session_state and st.session_state.turn_detection_results:
-                latest_result = st.session_state.turn_detection_results[-1]
-                st.markdown(
-                    f"""
-                    <div style="padding: 10px; border-radius: 5px; background-color: #f0f2f6; margin-bottom: 10px;">
-                        <strong>あなた (リアルタイム):</strong> {latest_result["transcript"]}
-                    </div>
-                    """, 
-                    unsafe_allow_html=True
-                )
-                
-                # 相槌または応答を表示
-                st.markdown(
-                    f"""
-                    <div style="padding: 10px; border-radius: 5px; background-color: #e6f7ff; margin-bottom: 10px;">
-                        <strong>AI (リアルタイム):</strong> {latest_result["acknowledgement"]}
-                    </div>
-                    """, 
-                    unsafe_allow_html=True
-                )
         else:
             st.warning("⏸️ 録音停止中")
-        
-        # 現在の文字起こしと応答を表示
-        if st.session_state.current_transcript:
-            st.markdown(
-                f"""
-                <div style="padding: 10px; border-radius: 5px; background-color: #f0f2f6; margin-bottom: 10px;">
-                    <strong>あなた:</strong> {st.session_state.current_transcript}
-                </div>
-                """, 
-                unsafe_allow_html=True
-            )
-        
-        if st.session_state.current_response:
-            st.markdown(
-                f"""
-                <div style="padding: 10px; border-radius: 5px; background-color: #e6f7ff; margin-bottom: 10px;">
-                    <strong>AI:</strong> {st.session_state.current_response}
-                </div>
-                """, 
-                unsafe_allow_html=True
-            )
+
+        # 動的な部分はプレースホルダーに描画し、自動更新時はここだけを
+        # インプレース更新する（ページ全体の再実行を毎回行わない）
+        live_placeholder = st.empty()
+        _render_live_conversation(live_placeholder)
     
     with tab2:
         # ターン判定結果の表示
@@ -899,18 +1254,35 @@ def main():
         st.subheader("会話履歴")
         
         if st.session_state.transcripts and st.session_state.responses:
-            for i in range(min(len(st.session_state.transcripts), len(st.session_state.responses))):
-                st.markdown(
+            # レンダリング済みHTMLをキャッシュし、新しいメッセージの分だけ生成する
+            # （自動更新のたびに全履歴を再構築するとセッションが長くなるほど遅くなる）
+            if "rendered_messages" not in st.session_state:
+                st.session_state.rendered_messages = []
+                st.session_state.rendered_count = 0
+
+            pair_count = min(len(st.session_state.transcripts), len(st.session_state.responses))
+
+            # 履歴がクリアされた場合はキャッシュを破棄
+            if st.session_state.rendered_count > pair_count:
+                st.session_state.rendered_messages = []
+                st.session_state.rendered_count = 0
+
+            for i in range(st.session_state.rendered_count, pair_count):
+                user_html = html.escape(st.session_state.transcripts[i])
+                ai_html = html.escape(st.session_state.responses[i])
+                st.session_state.rendered_messages.append(
                     f"""
                     <div style="padding: 10px; border-radius: 5px; background-color: #f0f2f6; margin-bottom: 5px;">
-                        <strong>あなた:</strong> {st.session_state.transcripts[i]}
+                        <strong>あなた:</strong> {user_html}
                     </div>
                     <div style="padding: 10px; border-radius: 5px; background-color: #e6f7ff; margin-bottom: 15px;">
-                        <strong>AI:</strong> {st.session_state.responses[i]}
+                        <strong>AI:</strong> {ai_html}
                     </div>
-                    """, 
-                    unsafe_allow_html=True
+                    """
                 )
+            st.session_state.rendered_count = pair_count
+
+            st.markdown("".join(st.session_state.rendered_messages), unsafe_allow_html=True)
         else:
             st.info("まだ会話履歴はありません")
 
@@ -927,8 +1299,24 @@ def main():
     # グローバル変数からセッション状態に値をコピー
     if _current_transcript:
         st.session_state.current_transcript = _current_transcript
-    if _current_response:
-        st.session_state.current_response = _current_response
+    if _current_response_parts:
+        st.session_state.current_response = _get_current_response()
+
+    # 自動更新
+    # 録音中・生成中は動的セクションをプレースホルダーにインプレース更新し、
+    # 履歴やログを含むページ全体の再実行は約1秒に1回に抑える。
+    # アイドル時は長い間隔でそのまま再実行する
+    if auto_refresh:
+        if _is_generating or st.session_state.is_listening:
+            deadline = time.monotonic() + 1.0
+            while time.monotonic() < deadline:
+                time.sleep(0.2)
+                update_session_state()
+                _render_live_conversation(live_placeholder)
+        else:
+            time.sleep(5.0)
+            update_session_state()
+        st.rerun()
 
 if __name__ == "__main__":
     logger.info("アプリケーションを起動します。")
@@ -6,27 +6,42 @@ import time
 import threading
 import queue
 import logging
+import logging.handlers
 import json
 import re
 import signal
 import sys
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
 from dotenv import load_dotenv
 import traceback
 
+try:
+    import orjson  # 状態ファイルの高速なシリアライズに使用
+except ImportError:
+    orjson = None  # orjsonが無い環境では標準ライブラリのjsonにフォールバック
+
 from speech_to_text_cli import SpeechToTextCLI as SpeechToTextStreaming
 from llm_manager import LLMManager
 
 # ロギングの設定
+# QueueHandler経由にして、ファイル・コンソールへの実I/Oはリスナースレッドが
+# 行う。LLM処理スレッドのlogger.info(...)はキュー投入だけで戻る
+_log_queue = queue.SimpleQueue()
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("cli_app.log"),
-        logging.StreamHandler()
-    ]
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
+)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.FileHandler("cli_app.log"),
+    logging.StreamHandler()
 )
+_log_listener.start()
 logger = logging.getLogger(__name__)
 
 # 環境変数の読み込み
@@ -49,12 +64,47 @@ _responses = []
 _current_transcript = ""
 _current_response = ""
 _is_generating = False
-_accumulated_context = ""
-_turn_detection_results = []
+# 「会話継続」と判定された言いかけの断片。完結時の生成プロンプトに前置して
+# 部分発話を取りこぼさない。+=による文字列連結はO(N^2)になるうえ判定が
+# 継続を返し続けると際限なく伸びるため、直近分のみ保持するdequeに積む
+_accumulated_context = deque(maxlen=16)
+# ターン判定結果は直近分だけ保持すれば十分。固定容量のdequeにして
+# メモリと保存コストがセッション長に比例して伸びないようにする
+_TURN_RESULTS_MAX = 500
+_turn_detection_results = deque(maxlen=_TURN_RESULTS_MAX)
+
+# (transcripts, responses)の不変スナップショット。書き込み側はロック下で
+# 新しいタプルを構築して1回の属性代入で公開する（GILにより代入はアトミック）
+# ので、履歴の読み取り側はロックを取らずに一貫したペアを参照できる
+_history_snapshot = ((), ())
+
+# LLMプロンプト用の会話履歴。ターンごとに1要素追記するだけで再構築せず、
+# maxlenで直近のターンに限定してプロンプトのトークン数もO(K)で頭打ちにする
+_HISTORY_WINDOW = 32
+_history_parts = deque(maxlen=_HISTORY_WINDOW)
 
 # ファイルベースの状態保存
+# スナップショット（_STATE_FILE）と追記専用のイベントログ（_STATE_LOG_FILE）の
+# 2段構成。ホットパスではイベントを1行追記するだけで、全履歴のJSON書き直しは
+# 読み込み時・履歴クリア時・終了時の畳み込み（コンパクション）でのみ行う
 _STATE_FILE = "cli_app_state.json"
+_STATE_LOG_FILE = "cli_app_state.jsonl"
 _state_lock = threading.RLock()
+_state_log = None  # イベントログのファイルハンドル（遅延オープン）
+
+# 投機的な応答生成用のエグゼキュータ（ターン判定と本応答のLLM呼び出しを重ねる）
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm")
+
+# 立て続けに確定する文字起こしの合流（デバウンス）用
+_COALESCE_WINDOW = 0.3  # この秒数以内に前回の拡張が来たら置き換える
+_enqueue_lock = threading.Lock()
+_last_enqueued = None  # {"slot": 可変のキュー項目, "time": 投入時刻}
+
+# ターン表示用のANSIカラー書式。%演算子のバウンドメソッドを前計算しておき、
+# ホットパスではフォーマット1回とsys.stdout.write 1回で1ブロックを出力する
+_USR_FMT = "\n\033[94mあなた: %s\033[0m\n".__mod__
+_ACK_FMT = "\033[92mAI (相槌): %s\033[0m\n".__mod__
+_AI_PREFIX = "\033[92mAI: "
 
 # 会話ターン判定用のシステムプロンプト
 TURN_DETECTION_PROMPT = """
@@ -85,28 +135,144 @@ CONVERSATION_SYSTEM_PROMPT = """
 応答は簡潔で分かりやすく、親しみやすい口調を心がけてください。
 """
 
+# ルールベースのターン判定で使うマーカー。
+# 大多数の発言はこれらの規則だけで判定でき、LLM往復を払う必要がない。
+# 質問マーカーはコンパイル済み正規表現1本にまとめ、発言を1回の走査で調べる
+_QUESTION_RE = re.compile(r'[?？]|何|どう|なぜ|いつ|どこ|だれ|誰|ですか')
+_SENTENCE_FINAL_ENDINGS = ("。", "?", "？", "ね", "よ", "ます", "です", "ました", "でした")
+
+def _classify_turn_rules(transcript):
+    """
+    ルールだけでターン判定できる場合はその結果を返す
+
+    質問マーカーや文末表現は発言の完結を、文末マーカーのない短い発言は
+    続きがあることを強く示すため、LLMに聞くまでもない。曖昧な場合
+    （文末マーカーのない中間的な長さの発言）のみNoneを返してLLMに回す。
+
+    Returns:
+        tuple: (会話継続か, 相槌) / 判定できない場合はNone
+    """
+    stripped = transcript.strip()
+
+    if _QUESTION_RE.search(stripped):
+        return False, "ご質問にお答えします"
+    if stripped.endswith(_SENTENCE_FINAL_ENDINGS):
+        return False, "なるほど"
+    if len(stripped) < 10:
+        return True, "はい"
+    if len(stripped) > 30:
+        # 長い発言が文末マーカーなしで確定するのは稀。完結として扱う
+        return False, "なるほど"
+    return None
+
+# ターン判定結果のキャッシュ。ストリーミングASRは「今日は」「今日は…」のように
+# ほぼ同一の発言を繰り返し確定させるため、同じ分類のためにLLM往復を払い直さない
+_turn_cache = OrderedDict()
+_TURN_CACHE_MAX_SIZE = 512
+
+def _turn_cache_key(transcript):
+    """ターン判定キャッシュのキーを正規化する（NFKC + 小文字化で表記揺れを吸収）"""
+    return unicodedata.normalize("NFKC", transcript.strip()).lower()
+
+def _classify_turn_fast(transcript):
+    """
+    LLMを呼ばずにターン判定できる場合はその結果を返す
+
+    ルールテーブルとキャッシュだけを見る。ここで判定がつく発言は
+    投機的な応答生成を起動する必要もない（判定を隠すべきLLM往復が
+    そもそも発生しない）ため、呼び出し側はNoneのときだけ投機実行する。
+
+    Returns:
+        tuple: (会話継続か, 相槌, LLMの生応答) / 判定できない場合はNone
+    """
+    rule_result = _classify_turn_rules(transcript)
+    if rule_result is not None:
+        continue_conversation, ack = rule_result
+        logger.info(f"ルールベース判定: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
+        return continue_conversation, ack, ""
+
+    key = _turn_cache_key(transcript)
+    if key in _turn_cache:
+        _turn_cache.move_to_end(key)
+        continue_conversation, ack = _turn_cache[key]
+        logger.info(f"ターン判定キャッシュヒット: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
+        return continue_conversation, ack, ""
+
+    return None
+
+def _classify_turn_llm(transcript):
+    """
+    ターン判定LLMを呼び出して判定し、結果をキャッシュする
+
+    Returns:
+        tuple: (会話継続か, 相槌, LLMの生応答)
+    """
+    key = _turn_cache_key(transcript)
+
+    turn_response = _llm_manager.call_model(
+        prompt=transcript,
+        system_prompt=TURN_DETECTION_PROMPT,
+        model="gemini-2.0-flash-lite",
+        stream=False
+    )
+    logger.info(f"ターン判定結果: {turn_response}")
+
+    continue_conversation, ack = parse_turn_decision(turn_response, transcript)
+
+    # 判定結果をキャッシュに保存（上限超過時は最も古いものから削除）
+    _turn_cache[key] = (continue_conversation, ack)
+    if len(_turn_cache) > _TURN_CACHE_MAX_SIZE:
+        _turn_cache.popitem(last=False)
+
+    return continue_conversation, ack, turn_response
+
+def _extract_json_block(response_text):
+    """
+    応答テキストから最初のJSONオブジェクトを1回の走査で切り出す
+
+    正規表現のDOTALLバックトラックの代わりに波括弧の深さを数えて対応する
+    閉じ括弧を見つける。```json```のようなコードフェンスに包まれていても、
+    フェンスの外側は走査で自然に読み飛ばされる。文字列リテラル内の括弧と
+    エスケープも考慮する。
+    """
+    start = response_text.find("{")
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(response_text)):
+        ch = response_text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return response_text[start:i + 1]
+    return None
+
 def parse_turn_decision(response_text, transcript):
     """
     LLMからのターン判定応答をパースする関数
     """
     try:
-        # JSONブロックを抽出
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # ```jsonなしの場合、直接JSONを探す
-            json_match = re.search(r'({.*})', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = response_text
-        
-        # 余分な文字を削除
-        json_str = re.sub(r'[^\x00-\x7F]+', '', json_str)  # 非ASCII文字を削除
-        
-        # JSONをパース
-        result = json.loads(json_str)
+        # JSONオブジェクトを抽出
+        json_str = _extract_json_block(response_text)
+        if json_str is None:
+            json_str = response_text
+
+        # JSONをパース（日本語の値もそのまま扱えるので前処理は不要）
+        result = orjson.loads(json_str) if orjson is not None else json.loads(json_str)
         
         # キーの正規化（camelCaseとsnake_caseの両方に対応）
         continue_conversation = result.get('continueConversation', result.get('continue_conversation', False))
@@ -120,7 +286,7 @@ def parse_turn_decision(response_text, transcript):
         
         # バックアップヒューリスティック
         is_short = len(transcript) < 10
-        has_question = any(q in transcript for q in ["?", "？", "何", "どう", "なぜ", "いつ", "どこ", "だれ", "誰", "ですか"])
+        has_question = bool(_QUESTION_RE.search(transcript))
         
         if has_question:
             return False, "ご質問にお答えします"
@@ -137,31 +303,111 @@ def save_state():
         state = {
             "transcripts": _transcripts,
             "responses": _responses,
-            "turn_detection_results": _turn_detection_results
+            "turn_detection_results": list(_turn_detection_results)
         }
         
         try:
-            with open(_STATE_FILE, "w", encoding="utf-8") as f:
-                json.dump(state, f, ensure_ascii=False, indent=2)
+            if orjson is not None:
+                with open(_STATE_FILE, "wb") as f:
+                    f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+            else:
+                with open(_STATE_FILE, "w", encoding="utf-8") as f:
+                    json.dump(state, f, ensure_ascii=False, indent=2)
             logger.info(f"状態をファイルに保存しました。転記数: {len(_transcripts)}, 応答数: {len(_responses)}")
         except Exception as e:
             logger.error(f"状態の保存中にエラーが発生しました: {str(e)}")
 
+# 永続化イベントの書き込みキューとライタースレッド
+# （シリアライズとディスクI/Oを応答生成のホットパスから切り離す）
+_persist_queue = queue.Queue()
+_writer_thread = None
+
+def _persist_writer_loop():
+    """永続化イベントをキューから取り出してJSONLに書き込むループ（デーモンスレッド）"""
+    global _state_log
+
+    while True:
+        event = _persist_queue.get()
+        try:
+            if event is None:
+                # 停止センチネル
+                break
+            with _state_lock:
+                if _state_log is None:
+                    _state_log = open(_STATE_LOG_FILE, "a", buffering=1, encoding="utf-8")
+                if orjson is not None:
+                    line = orjson.dumps(event).decode("utf-8")
+                else:
+                    line = json.dumps(event, ensure_ascii=False)
+                _state_log.write(line + "\n")
+        except Exception as e:
+            logger.error(f"状態イベントの書き込み中にエラーが発生しました: {str(e)}")
+        finally:
+            _persist_queue.task_done()
+
+def _append_state_event(event):
+    """
+    状態イベントを書き込みキューに積む
+
+    実際のシリアライズとファイル追記はライタースレッドが行うため、
+    呼び出し側（LLM処理スレッド）はディスクを待たない。
+    """
+    global _writer_thread
+
+    if _writer_thread is None or not _writer_thread.is_alive():
+        _writer_thread = threading.Thread(target=_persist_writer_loop, daemon=True)
+        _writer_thread.start()
+    _persist_queue.put(event)
+
+def _shutdown_writer(timeout=2.0):
+    """ライタースレッドに残りを書き切らせて停止する"""
+    if _writer_thread is not None and _writer_thread.is_alive():
+        _persist_queue.put(None)
+        _writer_thread.join(timeout=timeout)
+
+def _compact_state():
+    """イベントログをスナップショットに畳み込み、ログを空にする"""
+    global _state_log
+
+    # 書き込み待ちのイベントを先に掃かせてからログを切り詰める
+    # （切り詰め後に古いイベントが書かれると次回の再生で重複するため）
+    if _writer_thread is not None and _writer_thread.is_alive():
+        _persist_queue.join()
+
+    with _state_lock:
+        save_state()
+        try:
+            if _state_log is not None:
+                _state_log.close()
+                _state_log = None
+            open(_STATE_LOG_FILE, "w", encoding="utf-8").close()
+        except Exception as e:
+            logger.error(f"状態ログの切り詰め中にエラーが発生しました: {str(e)}")
+
 def load_state():
     """
     保存された状態をファイルから読み込む
     """
-    global _transcripts, _responses, _turn_detection_results
+    global _transcripts, _responses, _turn_detection_results, _history_snapshot
     
     if os.path.exists(_STATE_FILE):
         try:
-            with open(_STATE_FILE, "r", encoding="utf-8") as f:
-                state = json.load(f)
+            with open(_STATE_FILE, "rb") as f:
+                data = f.read()
+            state = orjson.loads(data) if orjson is not None else json.loads(data)
                 
             with _state_lock:
                 _transcripts = state.get("transcripts", [])
                 _responses = state.get("responses", [])
-                _turn_detection_results = state.get("turn_detection_results", [])
+                _turn_detection_results = deque(
+                    state.get("turn_detection_results", []), maxlen=_TURN_RESULTS_MAX
+                )
+
+                # プロンプト用の履歴を復元分から構築し直す（以降はターンごとの追記のみ）
+                _history_parts.clear()
+                for i in range(min(len(_transcripts), len(_responses))):
+                    _history_parts.append(f"ユーザー: {_transcripts[i]}\nAI: {_responses[i]}\n")
+                _history_snapshot = (tuple(_transcripts), tuple(_responses))
                 
             logger.info(f"ファイルから状態を読み込みました。転記数: {len(_transcripts)}, 応答数: {len(_responses)}")
         except Exception as e:
@@ -169,114 +415,244 @@ def load_state():
     else:
         logger.info("状態ファイルが見つかりません。新しい状態を作成します。")
 
+    # スナップショット以降に追記されたイベントログを再生する
+    if os.path.exists(_STATE_LOG_FILE):
+        try:
+            with open(_STATE_LOG_FILE, "r", encoding="utf-8") as f:
+                with _state_lock:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        event = orjson.loads(line) if orjson is not None else json.loads(line)
+                        event_type = event.pop("type", None)
+                        if event_type == "turn":
+                            _transcripts.append(event["transcript"])
+                            _responses.append(event["response"])
+                            _history_parts.append(
+                                f"ユーザー: {event['transcript']}\nAI: {event['response']}\n"
+                            )
+                        elif event_type == "turn_detection":
+                            _turn_detection_results.append(event)
+            with _state_lock:
+                _history_snapshot = (tuple(_transcripts), tuple(_responses))
+            # 再生した分をスナップショットへ畳み込む
+            _compact_state()
+            logger.info("イベントログを再生してスナップショットに畳み込みました。")
+        except Exception as e:
+            logger.error(f"状態ログの再生中にエラーが発生しました: {str(e)}")
+
+def _generate_response(transcript, print_event=None, abort_event=None):
+    """
+    会話履歴を含めた本応答をLLMでストリーミング生成する（ブロッキング）
+
+    チャンクはリストに蓄積し、print_eventがセットされていれば到着した
+    そばから標準出力に流す（ターン判定の確定前は投機的な生成なので出力
+    しない。確定後にセットされると未出力分もまとめて吐き出す）。
+
+    abort_eventがセットされるとコールバックがFalseを返してストリームを
+    打ち切る。Futureのcancel()は実行中のタスクを止められないため、
+    破棄が決まった投機的生成はこのイベントで早期に終わらせ、エグゼキュータの
+    ワーカーを塞いだまま_current_responseを古いターンの文章で上書きし続ける
+    ことがないようにする。
+    """
+    global _current_response
+
+    # 会話履歴は追記済みのリストを結合するだけ（毎ターンの全再構築はO(N^2)になる）
+    current_context = f"{''.join(_history_parts)}ユーザー: {transcript}\nAI: "
+
+    parts = []
+    printed = [0]  # 出力済みチャンク数（クロージャから更新するためリストで持つ）
+
+    def on_chunk(chunk):
+        global _current_response
+        if abort_event is not None and abort_event.is_set():
+            return False  # 破棄済みのターン: ストリームを打ち切り、グローバルも触らない
+        parts.append(chunk)
+        _current_response = "".join(parts)  # UI側のポーリング用に逐次更新
+        if print_event is not None and print_event.is_set():
+            sys.stdout.write("".join(parts[printed[0]:]))
+            sys.stdout.flush()
+            printed[0] = len(parts)
+
+    response_text = _llm_manager.call_model(
+        prompt=current_context,
+        system_prompt=CONVERSATION_SYSTEM_PROMPT,
+        model="gemini-2.0-flash-lite",
+        stream=True,
+        stream_callback=on_chunk
+    )
+
+    # 生成完了後、許可済みなのに未出力のチャンクが残っていればここで流す
+    # （判定確定より先に生成が終わったケース）
+    if print_event is not None and print_event.is_set() and printed[0] < len(parts):
+        sys.stdout.write("".join(parts[printed[0]:]))
+        sys.stdout.flush()
+        printed[0] = len(parts)
+
+    return response_text
+
 def process_transcripts():
     """
     音声認識結果を処理するスレッド関数
     """
     global _is_listening, _transcript_queue, _llm_manager, _transcripts, _responses
     global _current_transcript, _current_response, _is_generating, _accumulated_context, _turn_detection_results
+    global _history_snapshot
     
     logger.info("文字起こし処理スレッドを開始します。")
     
     while _is_listening:
         try:
-            if not _transcript_queue.empty():
-                transcript = _transcript_queue.get(timeout=0.1)
-                logger.info(f"キューから取得した文字起こし: {transcript}")
-                
-                # グローバル変数に保存
-                _current_transcript = transcript
-                
-                # LLMを使用してターン判定
-                turn_response = _llm_manager.call_model(
-                    prompt=transcript,
-                    system_prompt=TURN_DETECTION_PROMPT,
-                    model="gemini-2.0-flash-lite",
-                    stream=False
+            # ブロッキングgetでキューを待つ（empty()チェック+sleepのポーリングより
+            # 投入直後に起きられ、アイドル時のCPU消費もない）
+            try:
+                item = _transcript_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if item is None:
+                # 停止時に積まれるセンチネル
+                break
+
+            # 項目を消費済みにしてから中身を読む（以降の拡張は新規投入される）
+            with _enqueue_lock:
+                item["consumed"] = True
+                transcript = item["text"]
+
+            logger.info(f"キューから取得した文字起こし: {transcript}")
+
+            # グローバル変数に保存
+            _current_transcript = transcript
+
+            # 言いかけの断片が溜まっていれば今回の発言に前置して1つの発話に戻す
+            if _accumulated_context:
+                full_transcript = f"{' '.join(_accumulated_context)} {transcript}"
+            else:
+                full_transcript = transcript
+
+            # ルール・キャッシュで即決できる発言は投機的生成を起動しない
+            # （フィラーや明確な質問のたびに本応答のLLM呼び出しを発行すると、
+            # 破棄される実行が2ワーカーのエグゼキュータを埋めてしまう）
+            stream_print = threading.Event()
+            abort_speculative = threading.Event()
+            speculative = None
+            fast_result = _classify_turn_fast(transcript)
+            if fast_result is not None:
+                continue_conversation, ack, turn_response = fast_result
+            else:
+                # 曖昧な発言のみ: 本応答の生成を投機的に開始しつつ、ターン判定を
+                # 実行する。「会話完了」なら判定の待ち時間が生成の裏に隠れ、
+                # ユーザーの待ちはmax(判定, 生成)になる。「会話継続」なら破棄する
+                speculative = _executor.submit(
+                    _generate_response, full_transcript, stream_print, abort_speculative
                 )
-                logger.info(f"ターン判定結果: {turn_response}")
-                
-                # 改善されたJSONパーサーを使用
-                continue_conversation, ack = parse_turn_decision(turn_response, transcript)
-                logger.info(f"解析結果: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
-                
-                # 判定結果を保存
-                turn_result = {
-                    "transcript": transcript,
-                    "continue_conversation": continue_conversation,
-                    "acknowledgement": ack,
-                    "raw_response": turn_response,
-                    "timestamp": time.time()
-                }
-                
-                with _state_lock:
-                    _turn_detection_results.append(turn_result)
-                    save_state()
-                
-                # ターミナルに表示
-                print(f"\n\033[94mあなた: {transcript}\033[0m")
-                
-                if continue_conversation:
-                    # 会話継続の場合は相槌を表示
-                    print(f"\033[92mAI (相槌): {ack}\033[0m")
-                    
-                    # 短い発言を蓄積
-                    _accumulated_context += f"{transcript} "
-                else:
-                    # 会話完了の場合はLLM応答を生成
-                    print(f"\033[93mAI (応答生成中...)\033[0m")
-                    logger.info(f"会話完了と判断: 応答生成開始")
-                    _is_generating = True
-                    
-                    try:
-                        # 会話履歴を構築
-                        conversation_history = ""
-                        for i in range(min(len(_transcripts), len(_responses))):
-                            conversation_history += f"ユーザー: {_transcripts[i]}\nAI: {_responses[i]}\n"
-                        
-                        # 現在の会話コンテキストを追加
-                        current_context = f"{conversation_history}ユーザー: {transcript}\nAI: "
-                        
-                        # LLM応答の生成
-                        response_text = _llm_manager.call_model(
-                            prompt=current_context,
-                            system_prompt=CONVERSATION_SYSTEM_PROMPT,
-                            model="gemini-2.0-flash-lite",
-                            stream=False
-                        )
-                        
-                        logger.info(f"LLM応答生成完了: {response_text[:100]}...")
-                        
-                        # 応答を保存
-                        with _state_lock:
-                            _transcripts.append(transcript)
-                            _responses.append(response_text)
-                            _current_response = response_text
-                            save_state()
-                        
-                        # ターミナルに表示
-                        print(f"\033[92mAI: {response_text}\033[0m")
-                        
-                    except Exception as e:
-                        logger.error(f"LLM応答生成中にエラーが発生しました: {str(e)}")
-                        logger.error(str(e))
-                        traceback.print_exc()
-                        print(f"\033[91mエラー: 応答生成に失敗しました\033[0m")
-                    finally:
-                        _is_generating = False
+                continue_conversation, ack, turn_response = _classify_turn_llm(transcript)
+            logger.info(f"解析結果: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
+
+            # 判定結果を保存
+            turn_result = {
+                "transcript": transcript,
+                "continue_conversation": continue_conversation,
+                "acknowledgement": ack,
+                "raw_response": turn_response,
+                "timestamp": time.time()
+            }
+
+            with _state_lock:
+                _turn_detection_results.append(turn_result)
+            _append_state_event({"type": "turn_detection", **turn_result})
+
+            if continue_conversation:
+                # 会話継続の場合は投機的な生成を破棄して相槌を表示
+                # （発言と相槌を1回のwriteでまとめて出力する）
+                if speculative is not None:
+                    # 開始前なら取り消し、実行中なら次のチャンクで打ち切らせる
+                    speculative.cancel()
+                    abort_speculative.set()
+                sys.stdout.write(_USR_FMT(transcript) + _ACK_FMT(ack))
+                sys.stdout.flush()
+
+                # 言いかけの断片として蓄積（完結時の生成プロンプトに前置する）
+                _accumulated_context.append(transcript)
+            else:
+                # 会話完了の場合はLLM応答をストリーミング表示する
+                logger.info(f"会話完了と判断: 応答生成開始")
+                _is_generating = True
+                # 蓄積分は今回の発話に取り込んだのでフラッシュする
+                _accumulated_context.clear()
+
+                try:
+                    # 以降のチャンクを到着順に出力する許可を出し、生成完了を待つ
+                    sys.stdout.write(_USR_FMT(transcript) + _AI_PREFIX)
+                    sys.stdout.flush()
+                    stream_print.set()
+                    if speculative is not None:
+                        response_text = speculative.result()
+                    else:
+                        # 即決判定のため投機実行していない: ここで生成する
+                        # （stream_printはセット済みなのでチャンクは到着順に流れる）
+                        response_text = _generate_response(full_transcript, stream_print)
+                    sys.stdout.write("\033[0m\n")
+                    sys.stdout.flush()
+
+                    logger.info(f"LLM応答生成完了: {response_text[:100]}...")
+
+                    # 応答を保存
+                    with _state_lock:
+                        _transcripts.append(full_transcript)
+                        _responses.append(response_text)
+                        _history_parts.append(f"ユーザー: {full_transcript}\nAI: {response_text}\n")
+                        _current_response = response_text
+                        # 読み取り側（履歴表示）向けの不変スナップショットを公開
+                        _history_snapshot = (tuple(_transcripts), tuple(_responses))
+                    _append_state_event({
+                        "type": "turn",
+                        "transcript": full_transcript,
+                        "response": response_text,
+                        "timestamp": time.time()
+                    })
+
+                except Exception as e:
+                    logger.error(f"LLM応答生成中にエラーが発生しました: {str(e)}")
+                    logger.error(str(e))
+                    traceback.print_exc()
+                    print(f"\033[91mエラー: 応答生成に失敗しました\033[0m")
+                finally:
+                    _is_generating = False
         except Exception as e:
             logger.error(f"文字起こしの処理中にエラーが発生しました: {str(e)}")
             logger.error(str(e))
             traceback.print_exc()
-        
-        time.sleep(0.1)  # CPUの使用率を下げるために短いスリープ
 
 def on_transcript(transcript):
     """
     音声認識結果を受け取るコールバック関数
+
+    ストリーミングASRは「今日は」「今日はどんな」のように直前の確定結果を
+    拡張した文字起こしを立て続けに確定させることがある。前回の項目がまだ
+    処理されておらず、新しい文字起こしがその前方一致の拡張なら、キューに
+    積み直さず項目の中身を置き換えて、古い内容へのLLM呼び出しを省く。
     """
-    if transcript.strip():
-        _transcript_queue.put(transcript)
+    global _last_enqueued
+
+    if not transcript.strip():
+        return
+
+    now = time.monotonic()
+    with _enqueue_lock:
+        last = _last_enqueued
+        if (last is not None
+                and now - last["time"] < _COALESCE_WINDOW
+                and not last["slot"].get("consumed")
+                and transcript.startswith(last["slot"]["text"])):
+            last["slot"]["text"] = transcript
+            last["time"] = now
+            return
+
+        slot = {"text": transcript}
+        _last_enqueued = {"slot": slot, "time": now}
+        _transcript_queue.put(slot)
 
 def signal_handler(sig, frame):
     """
@@ -285,22 +661,25 @@ def signal_handler(sig, frame):
     global _is_listening
     print("\n\033[93m終了処理中...\033[0m")
     _is_listening = False
+    _transcript_queue.put(None)  # ブロッキングget中のスレッドを即座に起こす
     time.sleep(1)  # スレッドが終了するのを待つ
+    _shutdown_writer()  # 書き込み残しを掃いてから終了
     print("\033[92m終了しました\033[0m")
     sys.exit(0)
 
 def print_history():
     """
-    会話履歴を表示する
+    会話履歴を表示する（ロック不要の不変スナップショットを参照する）
     """
-    if not _transcripts or not _responses:
+    transcripts, responses = _history_snapshot
+    if not transcripts or not responses:
         print("\033[93mまだ会話履歴はありません\033[0m")
         return
-    
+
     print("\n\033[1m===== 会話履歴 =====\033[0m")
-    for i in range(min(len(_transcripts), len(_responses))):
-        print(f"\033[94mあなた: {_transcripts[i]}\033[0m")
-        print(f"\033[92mAI: {_responses[i]}\033[0m")
+    for i in range(min(len(transcripts), len(responses))):
+        print(f"\033[94mあなた: {transcripts[i]}\033[0m")
+        print(f"\033[92mAI: {responses[i]}\033[0m")
         print()
 
 def main():
@@ -308,7 +687,8 @@ def main():
     メイン関数
     """
     global _is_listening, _llm_manager
-    
+    global _transcripts, _responses, _turn_detection_results, _history_snapshot
+
     # シグナルハンドラの設定
     signal.signal(signal.SIGINT, signal_handler)
     
@@ -348,10 +728,13 @@ def main():
                 
                 logger.info("Speech-to-Textの初期化に成功しました。")
                 
-                # LLMの初期化
-                logger.info("LLMを初期化します。")
-                _llm_manager = LLMManager()
-                logger.info("LLMの初期化に成功しました。")
+                # LLMの初期化（再開時も同じインスタンスを使い回す。
+                # 各プロバイダのクライアントはコネクションプールを持つため、
+                # 作り直すとターンごとにTCP+TLSハンドシェイクを払い直すことになる）
+                if _llm_manager is None:
+                    logger.info("LLMを初期化します。")
+                    _llm_manager = LLMManager()
+                    logger.info("LLMの初期化に成功しました。")
                 
                 # 音声認識の開始
                 _is_listening = True
@@ -378,6 +761,7 @@ def main():
             
             print("\033[92m音声認識を停止します...\033[0m")
             _is_listening = False
+            _transcript_queue.put(None)  # ブロッキングget中のスレッドを即座に起こす
             logger.info("音声認識を停止しました。")
         
         elif cmd == 'h' or cmd == 'history':
@@ -387,8 +771,10 @@ def main():
             with _state_lock:
                 _transcripts = []
                 _responses = []
-                _turn_detection_results = []
-                save_state()
+                _turn_detection_results = deque(maxlen=_TURN_RESULTS_MAX)
+                _history_parts.clear()
+                _history_snapshot = ((), ())
+            _compact_state()
             print("\033[92m会話履歴をクリアしました\033[0m")
             logger.info("会話履歴をクリアしました。")
         
@@ -396,8 +782,11 @@ def main():
             if _is_listening:
                 print("\033[93m録音を停止しています...\033[0m")
                 _is_listening = False
+                _transcript_queue.put(None)  # ブロッキングget中のスレッドを即座に起こす
                 time.sleep(1)  # スレッドが終了するのを待つ
             
+            _compact_state()  # イベントログをスナップショットへ畳み込んでから終了
+            _shutdown_writer()
             print("\033[92m終了します\033[0m")
             break
         
@@ -2,18 +2,230 @@
 LLMモデルを管理するためのモジュール
 """
 import os
-from typing import Dict, List, Optional, Any, Callable
+import time
+import asyncio
+import threading
+import zlib
+import hashlib
+import difflib
+import functools
+import html
+from typing import Dict, List, Optional, Any, Callable, Sequence
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from google import genai
-from openai import OpenAI
-import anthropic
+import numpy as np
+import httpx
 from dotenv import load_dotenv
 
+try:
+    import orjson  # 会話履歴の高速なシリアライズに使用
+except ImportError:
+    orjson = None  # orjsonが無い環境では標準ライブラリのjsonにフォールバック
+
 # 環境変数の読み込み
 load_dotenv()
 
+# 期限付き呼び出しで全モデルが時間切れだったときの戻り値。呼び出し側は
+# これと比較してヒューリスティック等へ切り替えられる
+LLM_TIMEOUT_MESSAGE = "LLM呼び出しがタイムアウトしました"
+
+# プロバイダハンドラが失敗時に返すエラーメッセージの目印。これらは
+# 応答ではないのでキャッシュに入れない（入れると一時的なネットワーク
+# エラーがTTLの間ずっと再生され続け、近似一致キャッシュ経由では似た
+# プロンプトにまで伝播してしまう）
+_ERROR_RESPONSE_MARKERS = (
+    "エラーが発生しました: ",
+    "API Keyが設定されていません。",
+    "は利用できません。対応プレフィックス: ",
+    LLM_TIMEOUT_MESSAGE,
+)
+
+def _is_error_response(text: str) -> bool:
+    """ハンドラが返す失敗メッセージかどうかを判定する"""
+    return any(marker in text for marker in _ERROR_RESPONSE_MARKERS)
+
+# プロバイダSDKのimportは重い（google.genaiはprotobuf/grpcの副作用込みで
+# 数十ms単位）ため、最初に使うときまで遅延させる。使わないプロバイダの
+# 起動コストとメモリを払わずに済む
+_genai = None
+
+def _import_genai():
+    """google.genaiを最初の利用時にimportして返す"""
+    global _genai
+    if _genai is None:
+        from google import genai
+        _genai = genai
+    return _genai
+
+# Gemini（旧API）の生成設定と安全性設定。呼び出しごとに組み立て直す必要は
+# ないのでモジュール定数として1度だけ構築する
+_GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.9,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 2048,
+}
+
+_GEMINI_SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+]
+
+@functools.lru_cache(maxsize=8)
+def _legacy_gemini_model(model: str):
+    """旧API用のGenerativeModelをモデル名ごとに1度だけ構築して使い回す"""
+    return _import_genai().GenerativeModel(
+        model_name=model,
+        generation_config=_GEMINI_GENERATION_CONFIG,
+        safety_settings=_GEMINI_SAFETY_SETTINGS
+    )
+
+class _ChunkBatcher:
+    """
+    ストリーミングチャンクを短い時間窓でまとめてコールバックに渡すバッファ
+
+    SSEの断片ごとにコールバック（多くはUI更新）を呼ぶと、トークンが速く
+    流れるほどコールバック回数が支配的になる。batch_msの窓で溜めてから
+    結合して1回呼ぶことで、コールバックは最大でも毎秒1000/batch_ms回に
+    抑えられる。コールバックがFalseを返した場合の打ち切りもそのまま伝える。
+    """
+
+    def __init__(self, callback: Optional[Callable[[str], Any]], batch_ms: float = 20):
+        self.callback = callback
+        self.interval = batch_ms / 1000.0
+        self.pending: List[str] = []
+        self.last_flush = time.monotonic()
+
+    def feed(self, text: str) -> bool:
+        """チャンクを溜め、窓が満ちたらフラッシュする。Falseで打ち切り"""
+        if self.callback is None:
+            return True
+        self.pending.append(text)
+        if time.monotonic() - self.last_flush >= self.interval:
+            return self.flush()
+        return True
+
+    def flush(self) -> bool:
+        """溜まっているチャンクをまとめてコールバックに渡す。Falseで打ち切り"""
+        if self.callback is None or not self.pending:
+            return True
+        merged = "".join(self.pending)
+        self.pending.clear()
+        self.last_flush = time.monotonic()
+        return self.callback(merged) is not False
+
+
+class SemanticCache:
+    """
+    近似一致の応答キャッシュ
+
+    プロンプトを文字バイグラムのハッシュで固定次元の特徴ベクトルにし、
+    L2正規化した行列との内積（コサイン類似度）で最近傍を探す。音声認識の
+    表記揺れのように文字面がわずかに違うだけのプロンプトに対して、LLM往復を
+    ベクトル1本の照合で置き換える。システムプロンプトが異なるエントリには
+    ヒットさせない（文脈をまたいだ誤ヒットの防止）。
+
+    対象は短い単発の発話に限る。会話履歴を連結したような長いプロンプトは
+    ターンをまたいでバイグラムの大半を共有するため、コサイン類似度では
+    「前のターンとほぼ同じ」に見えてしまい、別の質問に前の応答を返す
+    誤ヒットが起きる。max_prompt_lenを超えるものと複数行のプロンプトは
+    登録も照合もしない。ヒット候補は長さ比でも検査し、問いの形だけ違う
+    発話（末尾の「か」の有無など）を拾わないよう文字数の近いものに限る。
+    """
+
+    def __init__(self, dim: int = 256, threshold: float = 0.92, max_entries: int = 256,
+                 max_prompt_len: int = 100):
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_prompt_len = max_prompt_len
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._prompts: List[str] = []
+        self._responses: List[str] = []
+        self._contexts: List[str] = []
+
+    @staticmethod
+    def _context_key(system_prompt: Optional[str]) -> str:
+        return hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """文字バイグラムのバッグをハッシュしてL2正規化ベクトルにする"""
+        text = text.strip()
+        if len(text) < 2 or len(text) > self.max_prompt_len or "\n" in text:
+            return None
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            bigram = text[i:i + 2]
+            vec[zlib.crc32(bigram.encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        if norm == 0.0:
+            return None
+        return vec / norm
+
+    def get(self, system_prompt: Optional[str], prompt: str) -> Optional[str]:
+        """類似度が閾値以上の既存エントリがあればその応答を返す"""
+        if not self._responses:
+            return None
+        query = self._embed(prompt)
+        if query is None:
+            return None
+        scores = self._matrix @ query  # 1回のBLAS gemvで全エントリと比較
+        context = self._context_key(system_prompt)
+        query_len = len(prompt.strip())
+        best_index = -1
+        best_score = self.threshold
+        for i in np.argsort(scores)[::-1]:
+            if scores[i] < best_score:
+                break
+            if self._contexts[i] != context:
+                continue
+            # バイグラムが似ていても長さが2割以上違うものは別の発話とみなす
+            stored_len = len(self._prompts[i])
+            if abs(stored_len - query_len) > 0.2 * max(stored_len, query_len):
+                continue
+            # バッグ表現は文字の並びを見ないので、最終候補だけ文字列として
+            # 突き合わせる（候補1件・100文字以下なのでコストは無視できる）
+            matcher = difflib.SequenceMatcher(None, self._prompts[i], prompt.strip())
+            if matcher.ratio() < 0.85:
+                continue
+            best_index = int(i)
+            break
+        if best_index < 0:
+            return None
+        return self._responses[best_index]
+
+    def put(self, system_prompt: Optional[str], prompt: str, response: str) -> None:
+        """エントリを追加する（容量超過時は最も古い行を落とす）"""
+        vec = self._embed(prompt)
+        if vec is None:
+            return
+        self._matrix = np.vstack([self._matrix, vec[None, :]])
+        self._prompts.append(prompt.strip())
+        self._responses.append(response)
+        self._contexts.append(self._context_key(system_prompt))
+        if len(self._responses) > self.max_entries:
+            self._matrix = self._matrix[1:]
+            self._prompts.pop(0)
+            self._responses.pop(0)
+            self._contexts.pop(0)
+
 class LLMManager:
     """
     複数のLLMモデルを管理し、会話を実行するためのクラス
@@ -29,30 +241,39 @@ class LLMManager:
         self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         
         # クライアントの初期化
+        # OpenAIとAnthropicにはプール付きのhttpxクライアントを共有させ、
+        # キープアライブ接続でTLSハンドシェイクを呼び出し間で償却する
+        self._httpx = httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=60,
+        )
+
         if self.google_api_key:
-            self.genai_client = genai.Client(api_key=self.google_api_key)
+            self.genai_client = _import_genai().Client(api_key=self.google_api_key)
         else:
             self.genai_client = None
         
         if self.openai_api_key:
-            self.openai_client = OpenAI(api_key=self.openai_api_key)
+            from openai import OpenAI  # キーのあるプロバイダだけimportする
+            self.openai_client = OpenAI(api_key=self.openai_api_key, http_client=self._httpx)
         else:
             self.openai_client = None
             
         if self.anthropic_api_key:
-            self.anthropic_client = anthropic.Anthropic(api_key=self.anthropic_api_key)
+            import anthropic  # キーのあるプロバイダだけimportする
+            self.anthropic_client = anthropic.Anthropic(api_key=self.anthropic_api_key, http_client=self._httpx)
         else:
             self.anthropic_client = None
         
-        # 利用可能なモデル
-        self.available_models = {
-            "gemini-2.0-flash-lite": self._call_gemini_new,
-            "gemini-1.5-pro": self._call_gemini_new,
-            "gemini-1.5-flash": self._call_gemini_new,
-            "gpt-4o": self._call_openai,
-            "claude-3-opus": self._call_anthropic,
-            "claude-3-sonnet": self._call_anthropic,
-        }
+        # プロバイダのプレフィックス → ハンドラ。モデル名を個別に列挙する
+        # 代わりに前方一致で振り分けるため、gpt-4o-miniのような新しいモデル名も
+        # 許可リストを更新せずにそのまま通る
+        self._providers = [
+            ("gemini-", self._call_gemini_new),
+            ("gpt-", self._call_openai),
+            ("o1-", self._call_openai),
+            ("claude-", self._call_anthropic),
+        ]
         
         # デフォルトのモデル設定
         self.assistant_model = os.getenv("ASSISTANT_MODEL", "gemini-2.0-flash-lite")
@@ -60,6 +281,51 @@ class LLMManager:
         
         # 会話履歴
         self.conversation_history = []
+        # 会話開始時刻のアンカー（メッセージにはここからの単調時計オフセットだけを持たせる）
+        self._t0_wall = None
+
+        # 完全一致の応答キャッシュ（非ストリーミング呼び出しのみ）。
+        # 同一の(モデル, システムプロンプト, プロンプト)にはプロバイダ往復を
+        # 払い直さない。TTLで古い応答を捨て、LRUで容量を抑える
+        self._response_cache = OrderedDict()
+        self._response_cache_max = 128
+        self._response_cache_ttl = 600  # 秒
+        self.cache_stats = {"hits": 0, "misses": 0}
+
+        # 近似一致の応答キャッシュ（完全一致キャッシュを外した場合の第2段）
+        self._semantic_cache = SemanticCache()
+
+        # 両キャッシュの参照・更新を覆うロック。_call_with_deadlineは時間切れの
+        # 呼び出しを走り切らせたままフォールバックを別スレッドで進めるため、
+        # 同一マネージャへの並行呼び出しは設計上起こりうる。SemanticCache.put
+        # は行列と各リストを順に更新する非アトミックな複合操作で、無防備だと
+        # 並行getが追加途中の行を読んでIndexErrorになる（完全一致側の
+        # get→move_to_end/delも同様にTTL境界で競合しうる）
+        self._cache_lock = threading.Lock()
+
+        # 期限付き呼び出し（timeout指定時）用のエグゼキュータ
+        self._call_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-call")
+
+        # 飛行中の同一リクエストの合流表。STTが重複した最終結果を出した
+        # 場合など、同じプロンプトが同時に来ても実際の呼び出しは1本にする
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        # システムプロンプトごとのOpenAI用systemメッセージ辞書。固定の
+        # システムプロンプトを呼び出しごとに辞書として作り直さない
+        self._openai_system_messages = {}
+
+        # (モデル, システムプロンプト)ごとのGenerateContentConfigキャッシュ。
+        # ターン判定・会話応答の固定プロンプトを毎呼び出しで包み直さず、
+        # 同一のconfigオブジェクトを使い回す
+        self._gemini_configs = {}
+
+        # Geminiの明示的コンテキストキャッシュ（caches.create）の管理。
+        # (モデル, システムプロンプト) → (キャッシュ名, 作成時刻)。
+        # 作成できないモデル/プロンプト（最小トークン数未満など）はNoneを
+        # 記録して以後の再試行を省く
+        self._gemini_cached_content = {}
+        self._gemini_cache_ttl = 600  # 秒
         
     def _call_gemini(self, 
                     prompt: str, 
@@ -84,38 +350,8 @@ class LLMManager:
             return "Google API Keyが設定されていません。"
         
         try:
-            generation_config = {
-                "temperature": 0.9,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 2048,
-            }
-            
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-            ]
-            
-            # モデルの初期化
-            genai_model = genai.GenerativeModel(
-                model_name=model,
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
+            # モデルの初期化（同一モデル名には構築済みインスタンスを使い回す）
+            genai_model = _legacy_gemini_model(model)
             
             # システムプロンプトがある場合は追加
             if system_prompt:
@@ -124,15 +360,21 @@ class LLMManager:
                 if stream:
                     response = chat.send_message(prompt, stream=True)
                     
-                    # ストリーミング処理
-                    full_response = ""
+                    # ストリーミング処理（コールバックは時間窓でまとめて呼ぶ）
+                    batcher = _ChunkBatcher(stream_callback)
+                    parts = []
                     for chunk in response:
-                        if hasattr(chunk, "text"):
-                            if stream_callback:
-                                stream_callback(chunk.text)
-                            full_response += chunk.text
-                    
-                    return full_response
+                        # hasattrはAttributeErrorをtry/exceptで握る分高くつくため、
+                        # getattrのデフォルト値で判定する
+                        text = getattr(chunk, "text", None)
+                        if text is not None:
+                            parts.append(text)
+                            # コールバックがFalseを返したらストリーミングを打ち切る
+                            # （必要な部分だけ読めば十分な呼び出し側のため）
+                            if not batcher.feed(text):
+                                break
+                    batcher.flush()
+                    return "".join(parts)
                 else:
                     response = chat.send_message(prompt)
                     return response.text
@@ -140,15 +382,21 @@ class LLMManager:
                 if stream:
                     response = genai_model.generate_content(prompt, stream=True)
                     
-                    # ストリーミング処理
-                    full_response = ""
+                    # ストリーミング処理（コールバックは時間窓でまとめて呼ぶ）
+                    batcher = _ChunkBatcher(stream_callback)
+                    parts = []
                     for chunk in response:
-                        if hasattr(chunk, "text"):
-                            if stream_callback:
-                                stream_callback(chunk.text)
-                            full_response += chunk.text
-                    
-                    return full_response
+                        # hasattrはAttributeErrorをtry/exceptで握る分高くつくため、
+                        # getattrのデフォルト値で判定する
+                        text = getattr(chunk, "text", None)
+                        if text is not None:
+                            parts.append(text)
+                            # コールバックがFalseを返したらストリーミングを打ち切る
+                            # （必要な部分だけ読めば十分な呼び出し側のため）
+                            if not batcher.feed(text):
+                                break
+                    batcher.flush()
+                    return "".join(parts)
                 else:
                     response = genai_model.generate_content(prompt)
                     return response.text
@@ -156,6 +404,42 @@ class LLMManager:
         except Exception as e:
             return f"Geminiモデルの呼び出し中にエラーが発生しました: {str(e)}"
     
+    def _gemini_cached_name(self, model: str, system_prompt: str) -> Optional[str]:
+        """
+        固定システムプロンプトのGemini明示キャッシュ名を返す
+
+        プレフィル（プロンプトのエンコード）のコストをターン間で償却するため、
+        システムプロンプトをプロバイダ側のコンテキストキャッシュに1度だけ登録
+        する。作成に失敗した場合（対象モデルが未対応・最小トークン数未満など）は
+        Noneを記録し、通常のsystem_instruction経路にフォールバックする。
+        TTL切れの前に作り直す。
+        """
+        key = (model, system_prompt)
+        entry = self._gemini_cached_content.get(key)
+        if entry is not None:
+            name, created_at = entry
+            # TTLの9割を過ぎたら期限切れ扱いで作り直す
+            if time.monotonic() - created_at < self._gemini_cache_ttl * 0.9:
+                return name
+        elif key in self._gemini_cached_content:
+            # 過去に作成へ失敗している（None記録済み）
+            return None
+
+        try:
+            genai = _import_genai()
+            cache = self.genai_client.caches.create(
+                model=model,
+                config=genai.types.CreateCachedContentConfig(
+                    system_instruction=system_prompt,
+                    ttl=f"{self._gemini_cache_ttl}s",
+                ),
+            )
+            self._gemini_cached_content[key] = (cache.name, time.monotonic())
+            return cache.name
+        except Exception:
+            self._gemini_cached_content[key] = None
+            return None
+
     def _call_gemini_new(self, 
                     prompt: str, 
                     system_prompt: Optional[str] = None, 
@@ -180,13 +464,25 @@ class LLMManager:
         
         try:
             # システムプロンプトがある場合は、configに含める
+            # （同じ組にはキャッシュ済みのconfigを使い回す）。明示キャッシュを
+            # 作れた場合はcached_contentで参照し、プレフィルを払い直さない
             contents = prompt
             config = None
             
             if system_prompt:
-                config = genai.types.GenerateContentConfig(
-                    system_instruction=system_prompt
-                )
+                cache_name = self._gemini_cached_name(model, system_prompt)
+                if cache_name:
+                    # キャッシュ名はTTLで入れ替わるためconfigは都度包む（軽量）
+                    config = _import_genai().types.GenerateContentConfig(
+                        cached_content=cache_name
+                    )
+                else:
+                    config = self._gemini_configs.get((model, system_prompt))
+                    if config is None:
+                        config = _import_genai().types.GenerateContentConfig(
+                            system_instruction=system_prompt
+                        )
+                        self._gemini_configs[(model, system_prompt)] = config
             
             if stream:
                 response = self.genai_client.models.generate_content_stream(
@@ -195,15 +491,18 @@ class LLMManager:
                     config=config
                 )
                 
-                # ストリーミング処理
-                full_response = ""
+                # ストリーミング処理（コールバックは時間窓でまとめて呼ぶ）
+                batcher = _ChunkBatcher(stream_callback)
+                parts = []
                 for chunk in response:
-                    if hasattr(chunk, "text"):
-                        if stream_callback:
-                            stream_callback(chunk.text)
-                        full_response += chunk.text
-                
-                return full_response
+                    text = getattr(chunk, "text", None)
+                    if text is not None:
+                        parts.append(text)
+                        # コールバックがFalseを返したらストリーミングを打ち切る
+                        if not batcher.feed(text):
+                            break
+                batcher.flush()
+                return "".join(parts)
             else:
                 response = self.genai_client.models.generate_content(
                     model=model,
@@ -238,10 +537,14 @@ class LLMManager:
             return "OpenAI API Keyが設定されていません。"
         
         try:
-            messages = []
             if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": prompt})
+                system_message = self._openai_system_messages.get(system_prompt)
+                if system_message is None:
+                    system_message = {"role": "system", "content": system_prompt}
+                    self._openai_system_messages[system_prompt] = system_message
+                messages = [system_message, {"role": "user", "content": prompt}]
+            else:
+                messages = [{"role": "user", "content": prompt}]
             
             if stream:
                 response = self.openai_client.chat.completions.create(
@@ -252,14 +555,19 @@ class LLMManager:
                     stream=True
                 )
                 
-                full_response = ""
+                batcher = _ChunkBatcher(stream_callback)
+                parts = []
                 for chunk in response:
-                    if chunk.choices and chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        if stream_callback:
-                            stream_callback(content)
-                        full_response += content
-                return full_response
+                    # 属性の辿り直しを避けるためdeltaを1回だけ取り出す
+                    delta = chunk.choices[0].delta if chunk.choices else None
+                    content = delta.content if delta else None
+                    if content:
+                        parts.append(content)
+                        # コールバックがFalseを返したらストリーミングを打ち切る
+                        if not batcher.feed(content):
+                            break
+                batcher.flush()
+                return "".join(parts)
             else:
                 response = self.openai_client.chat.completions.create(
                     model=model,
@@ -272,9 +580,28 @@ class LLMManager:
         except Exception as e:
             return f"OpenAIモデルの呼び出し中にエラーが発生しました: {str(e)}"
     
-    def _call_anthropic(self, 
-                       prompt: str, 
-                       system_prompt: Optional[str] = None, 
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _system_cache_block(system_prompt: Optional[str]):
+        """
+        システムプロンプトをプロンプトキャッシュ対象のブロックとして構築する
+
+        システムプロンプトは呼び出しごとに変わらないため、cache_controlを付与して
+        プロバイダ側のプレフィックスキャッシュ（2回目以降は再エンコード不要）を有効にする。
+        """
+        if not system_prompt:
+            return None
+        return [
+            {
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+
+    def _call_anthropic(self,
+                       prompt: str,
+                       system_prompt: Optional[str] = None,
                        model: str = "claude-3-sonnet",
                        stream: bool = False,
                        stream_callback: Optional[Callable[[str], None]] = None) -> str:
@@ -299,7 +626,7 @@ class LLMManager:
                 with self.anthropic_client.messages.stream(
                     model=model,
                     max_tokens=2048,
-                    system=system_prompt if system_prompt else None,
+                    system=self._system_cache_block(system_prompt),
                     messages=[
                         {
                             "role": "user",
@@ -308,17 +635,20 @@ class LLMManager:
                     ],
                     temperature=0.9,
                 ) as stream:
-                    full_response = ""
+                    batcher = _ChunkBatcher(stream_callback)
+                    parts = []
                     for text in stream.text_stream:
-                        if stream_callback:
-                            stream_callback(text)
-                        full_response += text
-                    return full_response
+                        parts.append(text)
+                        # コールバックがFalseを返したらストリーミングを打ち切る
+                        if not batcher.feed(text):
+                            break
+                    batcher.flush()
+                    return "".join(parts)
             else:
                 message = self.anthropic_client.messages.create(
                     model=model,
                     max_tokens=2048,
-                    system=system_prompt if system_prompt else None,
+                    system=self._system_cache_block(system_prompt),
                     messages=[
                         {
                             "role": "user",
@@ -332,38 +662,157 @@ class LLMManager:
         except Exception as e:
             return f"Anthropicモデルの呼び出し中にエラーが発生しました: {str(e)}"
     
+    @staticmethod
+    def _cache_key(model: str, system_prompt: Optional[str], prompt: str) -> str:
+        """応答キャッシュのキーを生成する（正規化JSONのSHA-256）"""
+        payload = json.dumps(
+            {"model": model, "system_prompt": system_prompt, "prompt": prompt},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
     def call_model(self, 
                   prompt: str, 
                   system_prompt: Optional[str] = None, 
                   model: Optional[str] = None,
                   stream: bool = False,
-                  stream_callback: Optional[Callable[[str], None]] = None) -> str:
+                  stream_callback: Optional[Callable[[str], None]] = None,
+                  timeout: Optional[float] = None,
+                  fallbacks: Sequence[str] = (),
+                  use_semantic_cache: bool = False) -> str:
         """
         指定されたモデルを呼び出す
-        
+
         Args:
             prompt: プロンプト
             system_prompt: システムプロンプト
             model: モデル名（指定しない場合はデフォルトモデルを使用）
             stream: ストリーミングモードを使用するかどうか
             stream_callback: ストリーミング時のコールバック関数
-            
+            timeout: 1モデルあたりの応答期限（秒）。超えたらfallbacksへ切り替える
+            fallbacks: timeout指定時に順に試す代替モデル名
+            use_semantic_cache: 近似一致キャッシュを使うかどうか。プロンプトが
+                履歴を含まない短い単発の発話で、似た発話に同じ応答を返して
+                よい呼び出し元だけが有効にする（ターン判定や履歴連結の
+                プロンプトでは前ターンの応答を誤って返すため使わない）
+
         Returns:
-            生成されたテキスト
+            生成されたテキスト（全モデルが時間切れならLLM_TIMEOUT_MESSAGE）
         """
         if not model:
             model = self.assistant_model
+
+        if timeout is not None:
+            return self._call_with_deadline(
+                prompt, system_prompt, model, stream, stream_callback, timeout,
+                fallbacks, use_semantic_cache
+            )
             
-        if model not in self.available_models:
-            return f"モデル '{model}' は利用できません。利用可能なモデル: {', '.join(self.available_models.keys())}"
-            
-        return self.available_models[model](
-            prompt=prompt, 
-            system_prompt=system_prompt, 
-            model=model,
-            stream=stream,
-            stream_callback=stream_callback
-        )
+        handler = next((h for prefix, h in self._providers if model.startswith(prefix)), None)
+        if handler is None:
+            prefixes = ', '.join(prefix for prefix, _ in self._providers)
+            return f"モデル '{model}' は利用できません。対応プレフィックス: {prefixes}"
+
+        # ストリーミング時はコールバックに逐次渡す必要があるためキャッシュしない
+        key = None
+        if not stream:
+            key = self._cache_key(model, system_prompt, prompt)
+            with self._cache_lock:
+                cached = self._response_cache.get(key)
+                if cached is not None:
+                    cached_at, cached_response = cached
+                    if time.monotonic() - cached_at < self._response_cache_ttl:
+                        self._response_cache.move_to_end(key)
+                        self.cache_stats["hits"] += 1
+                        return cached_response
+                    del self._response_cache[key]
+
+                # 完全一致を外しても、ほぼ同じプロンプトなら近似一致で返せる
+                # （誤ヒットの影響を受けない呼び出し元がオプトインした場合のみ）
+                if use_semantic_cache:
+                    similar = self._semantic_cache.get(system_prompt, prompt)
+                    if similar is not None:
+                        self.cache_stats["hits"] += 1
+                        return similar
+                self.cache_stats["misses"] += 1
+
+        if key is None:
+            return handler(
+                prompt=prompt, 
+                system_prompt=system_prompt, 
+                model=model,
+                stream=stream,
+                stream_callback=stream_callback
+            )
+
+        # 同一キーの呼び出しが飛行中なら新しく発行せず、その結果に相乗りする
+        with self._inflight_lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = Future()
+                self._inflight[key] = pending
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return pending.result()
+
+        try:
+            response = handler(
+                prompt=prompt, 
+                system_prompt=system_prompt, 
+                model=model,
+                stream=stream,
+                stream_callback=stream_callback
+            )
+        except BaseException as exc:
+            pending.set_exception(exc)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+        pending.set_result(response)
+
+        # 失敗メッセージを覚えてしまうと復旧後もTTLの間エラーを返し続ける
+        if _is_error_response(response):
+            return response
+
+        with self._cache_lock:
+            self._response_cache[key] = (time.monotonic(), response)
+            if len(self._response_cache) > self._response_cache_max:
+                self._response_cache.popitem(last=False)
+            if use_semantic_cache:
+                self._semantic_cache.put(system_prompt, prompt, response)
+
+        return response
+
+    def _call_with_deadline(self, prompt, system_prompt, model, stream,
+                            stream_callback, timeout, fallbacks, use_semantic_cache=False):
+        """
+        モデルを期限付きで呼び出し、時間切れならフォールバックに切り替える
+
+        プロバイダが詰まっているとき、呼び出しスレッド（Streamlit UIや
+        応答ワーカー）を無期限にブロックさせないための安全弁。タイムアウト
+        したスレッド自体は中断できないので走り切らせる（遅れて返った応答は
+        応答キャッシュに入るため、次の同じ発言には即答できる）。
+        """
+        for candidate in (model, *fallbacks):
+            future = self._call_executor.submit(
+                self.call_model,
+                prompt=prompt,
+                system_prompt=system_prompt,
+                model=candidate,
+                stream=stream,
+                stream_callback=stream_callback,
+                use_semantic_cache=use_semantic_cache,
+            )
+            try:
+                return future.result(timeout=timeout)
+            except FuturesTimeout:
+                print(f"モデル {candidate} が{timeout}秒以内に応答しませんでした。")
+                future.cancel()  # まだ開始前なら取り消す
+        return LLM_TIMEOUT_MESSAGE
     
     def simulate_conversation(self, 
                              initial_prompt: str, 
@@ -387,12 +836,18 @@ class LLMManager:
             会話履歴
         """
         conversation = []
-        
+
+        # 時刻は会話開始時に壁時計を1回だけ読み、以降のメッセージには単調時計の
+        # オフセット(ns)だけを記録する。ISO文字列への整形と逆パースは保存・描画
+        # 時まで遅延させる
+        self._t0_wall = datetime.now()
+        t0_mono = time.monotonic_ns()
+
         # 初期メッセージを追加
         conversation.append({
             "role": "human",
             "content": initial_prompt,
-            "timestamp": datetime.now().isoformat()
+            "t_offset_ns": 0
         })
         
         current_prompt = initial_prompt
@@ -411,7 +866,7 @@ class LLMManager:
             conversation.append({
                 "role": "assistant",
                 "content": assistant_response,
-                "timestamp": datetime.now().isoformat()
+                "t_offset_ns": time.monotonic_ns() - t0_mono
             })
             
             # 人間役の応答
@@ -427,7 +882,7 @@ class LLMManager:
             conversation.append({
                 "role": "human",
                 "content": human_response,
-                "timestamp": datetime.now().isoformat()
+                "t_offset_ns": time.monotonic_ns() - t0_mono
             })
             
             current_prompt = human_response
@@ -435,6 +890,67 @@ class LLMManager:
         self.conversation_history = conversation
         return conversation
     
+    async def simulate_conversation_async(self,
+                                          initial_prompt: str,
+                                          assistant_system_prompt: str,
+                                          human_system_prompt: str,
+                                          num_turns: int = 5) -> List[Dict[str, Any]]:
+        """
+        simulate_conversationをイベントループを塞がずに実行する
+
+        1つの会話の中ではアシスタント→人間役の依存連鎖があるため並列化
+        できないが、エグゼキュータに逃がすことで複数の独立した会話を
+        同じループ上で同時に走らせられる（simulate_manyから利用）。
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                self.simulate_conversation,
+                initial_prompt,
+                assistant_system_prompt,
+                human_system_prompt,
+                num_turns,
+            ),
+        )
+
+    async def simulate_many(self,
+                            initial_prompts: List[str],
+                            assistant_system_prompt: str,
+                            human_system_prompt: str,
+                            num_turns: int = 5,
+                            max_concurrency: int = 8) -> List[List[Dict[str, Any]]]:
+        """
+        複数の独立した会話シミュレーションを並行実行する
+
+        会話同士に依存はないので、逐次実行（N×会話時間）ではなく
+        同時に流して共有コネクションプールを多重利用する。同時実行数は
+        セマフォでAPIキーあたりmax_concurrencyに抑える。
+
+        Returns:
+            initial_promptsと同じ順序の会話履歴のリスト。
+            self.conversation_historyには最後に完了した会話が残る点に注意。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(prompt: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self.simulate_conversation_async(
+                    prompt,
+                    assistant_system_prompt,
+                    human_system_prompt,
+                    num_turns,
+                )
+
+        return list(await asyncio.gather(*(run_one(p) for p in initial_prompts)))
+
+    def _message_datetime(self, message: Dict[str, Any]) -> datetime:
+        """メッセージの壁時計時刻を復元する（旧形式のtimestampにも対応）"""
+        if "timestamp" in message:
+            return datetime.fromisoformat(message["timestamp"])
+        t0 = self._t0_wall or datetime.now()
+        return t0 + timedelta(microseconds=message.get("t_offset_ns", 0) / 1000)
+
     def save_conversation(self, filename: str = None) -> str:
         """
         会話履歴をJSONファイルに保存する
@@ -455,8 +971,24 @@ class LLMManager:
         # ディレクトリが存在しない場合は作成
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(self.conversation_history, f, ensure_ascii=False, indent=2)
+        # 保存ファイルの形式は従来どおりtimestamp付きにする（オフセットはここで整形）
+        serializable = [
+            {
+                "role": m["role"],
+                "content": m["content"],
+                "timestamp": self._message_datetime(m).isoformat(),
+            }
+            for m in self.conversation_history
+        ]
+
+        # インデントなしのコンパクトなJSONで書き出す（整形はファイルサイズと
+        # シリアライズ時間を増やすだけで、読み手はビューアで整形できる）
+        if orjson is not None:
+            with open(filename, "wb") as f:
+                f.write(orjson.dumps(serializable))
+        else:
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(serializable, f, ensure_ascii=False, separators=(",", ":"))
             
         return filename
     
@@ -480,7 +1012,7 @@ class LLMManager:
         # ディレクトリが存在しない場合は作成
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         
-        html_content = """
+        html_header = """
         <!DOCTYPE html>
         <html lang="ja">
         <head>
@@ -546,32 +1078,37 @@ class LLMManager:
             <h1>LLM会話履歴</h1>
             <div class="chat-container">
         """
-        
+
+        # +=による文字列連結はO(N^2)になるため、断片リストに積んで最後に
+        # writelinesで書き出す
+        parts = [html_header]
+
         for message in self.conversation_history:
             role = message["role"]
             content = message["content"]
-            timestamp = datetime.fromisoformat(message["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+            timestamp = self._message_datetime(message).strftime("%Y-%m-%d %H:%M:%S")
             
             role_label = "人間" if role == "human" else "アシスタント"
             
-            # 改行をHTMLの<br>タグに置換
-            content_html = content.replace('\n', '<br>')
+            # HTMLエスケープしてから改行を<br>タグに置換
+            # （応答中の<や&でレイアウトが壊れないようにする）
+            content_html = html.escape(content).replace('\n', '<br>')
             
-            html_content += f"""
+            parts.append(f"""
                 <div class="message {role}">
                     <div class="role-label">{role_label}</div>
                     <div class="content">{content_html}</div>
                     <div class="timestamp">{timestamp}</div>
                 </div>
-            """
-        
-        html_content += """
+            """)
+
+        parts.append("""
             </div>
         </body>
         </html>
-        """
-        
+        """)
+
         with open(filename, "w", encoding="utf-8") as f:
-            f.write(html_content)
+            f.writelines(parts)
             
         return filename 
\ No newline at end of file
@@ -2,9 +2,11 @@
 Google Cloud Speech-to-Text APIを使用してストリーミング音声認識を行うモジュール
 """
 import os
+import mmap
 import queue
 import threading
 import time
+from collections import deque
 from typing import Callable, List, Optional
 
 import pyaudio
@@ -19,6 +21,7 @@ load_dotenv()
 RATE = 16000
 CHUNK = int(RATE / 10)  # 100ms
 LANGUAGE_CODE = "ja-JP"  # 日本語
+FILE_CHUNK_BYTES = 64 * 1024  # ファイル文字起こし時の1リクエストあたりの音声サイズ
 
 class SpeechToTextStreaming:
     """
@@ -55,9 +58,16 @@ class SpeechToTextStreaming:
         # 音声入力用の変数
         self.audio_interface = None
         self.audio_stream = None
+
+        # PyAudioのコールバックが積む音声チャンクのキュー。
+        # SimpleQueueはput/getが軽く、単一生産者・単一消費者のここでは十分
+        self._audio_queue = queue.SimpleQueue()
         
         # 音声認識結果を保存するキュー
-        self.result_queue = queue.Queue()
+        # queue.Queueはput/getのたびにロックを取り、非ブロッキングのドレインで
+        # Empty例外を量産するため、dequeと条件変数の組に置き換えている
+        self.result_queue = deque()
+        self._result_cv = threading.Condition()
         
         # 音声認識の状態
         self.is_listening = False
@@ -92,6 +102,16 @@ class SpeechToTextStreaming:
             streaming_config=self.streaming_config,
         )
     
+    def _pa_callback(self, in_data, frame_count, time_info, status):
+        """
+        PyAudioのコールバック（Cのオーディオスレッドから呼ばれる）
+
+        取得したバッファをキューに積むだけにして、ブロッキングreadで
+        GILを握るスレッドを置かない。
+        """
+        self._audio_queue.put_nowait(in_data)
+        return (None, pyaudio.paContinue)
+
     def _audio_generator(self):
         """
         マイクからの音声入力を生成するジェネレータ
@@ -100,8 +120,10 @@ class SpeechToTextStreaming:
             bytes: 音声データのチャンク
         """
         while self.is_listening:
-            # マイクから音声データを取得
-            data = self.audio_stream.read(CHUNK, exception_on_overflow=False)
+            data = self._audio_queue.get()
+            if data is None:
+                # stop_listeningが積む停止センチネル
+                break
             yield data
     
     def _request_generator(self):
@@ -119,6 +141,21 @@ class SpeechToTextStreaming:
             request = cloud_speech_types.StreamingRecognizeRequest(audio=audio_data)
             yield request
     
+    def _push_result(self, transcript: str, is_final: bool):
+        """
+        認識結果をキューに積む
+
+        末尾が未確定（中間）結果のまま残っている場合、新しい中間結果は追記
+        せずその場で置き換える。消費側が詰まってもキューは確定セグメント数
+        までしか伸びず、UI側は常に「今入力中の1件」だけを見ればよい。
+        """
+        with self._result_cv:
+            if self.result_queue and not self.result_queue[-1][1] and not is_final:
+                self.result_queue[-1] = (transcript, False)
+            else:
+                self.result_queue.append((transcript, is_final))
+            self._result_cv.notify()
+
     def _process_responses(self, responses, callback: Optional[Callable[[str, bool], None]] = None):
         """
         音声認識の応答を処理する
@@ -141,8 +178,8 @@ class SpeechToTextStreaming:
                 # 認識されたテキスト
                 transcript = result.alternatives[0].transcript
                 
-                # キューに追加
-                self.result_queue.put((transcript, is_final))
+                # キューに追加（中間結果は最新の1件に合流させる）
+                self._push_result(transcript, is_final)
                 
                 # コールバック関数がある場合は呼び出す
                 if callback:
@@ -158,8 +195,19 @@ class SpeechToTextStreaming:
         if self.is_listening:
             print("すでに音声認識を開始しています。")
             return
-            
-        # PyAudioの初期化
+
+        # 前回セッションの残留物を捨てる。gRPC側の都合でストリームが閉じると
+        # stop_listeningが積んだ停止センチネルが消費されずに残り、次の
+        # _audio_generatorが最初のgetで即終了してしまう（再開が無言で死ぬ）。
+        # センチネル後に積まれた音声チャンクも次セッションには無関係
+        while True:
+            try:
+                self._audio_queue.get_nowait()
+            except queue.Empty:
+                break
+
+        # PyAudioの初期化（コールバックモード：バッファはPyAudio側の
+        # オーディオスレッドから_pa_callback経由でキューに届く）
         self.audio_interface = pyaudio.PyAudio()
         self.audio_stream = self.audio_interface.open(
             format=pyaudio.paInt16,
@@ -167,10 +215,13 @@ class SpeechToTextStreaming:
             rate=RATE,
             input=True,
             frames_per_buffer=CHUNK,
+            stream_callback=self._pa_callback,
+            start=False,
         )
         
         # 音声認識の状態を更新
         self.is_listening = True
+        self.audio_stream.start_stream()
         
         # 音声認識を別スレッドで実行
         def listen_thread_func():
@@ -202,6 +253,7 @@ class SpeechToTextStreaming:
             
         # 音声認識の状態を更新
         self.is_listening = False
+        self._audio_queue.put(None)  # ジェネレータのブロッキングgetを起こす
         
         # 音声ストリームを閉じる
         if self.audio_stream:
@@ -227,17 +279,25 @@ class SpeechToTextStreaming:
         Returns:
             tuple: (認識されたテキスト, 最終結果かどうか)
         """
-        try:
-            return self.result_queue.get(block=block, timeout=timeout)
-        except queue.Empty:
-            return None
+        with self._result_cv:
+            if block:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self.result_queue:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._result_cv.wait(remaining)
+            if not self.result_queue:
+                return None
+            return self.result_queue.popleft()
     
     def clear_results(self):
         """
         音声認識の結果をクリアする
         """
-        while not self.result_queue.empty():
-            self.result_queue.get()
+        # 1件ずつgetで抜くのではなく、まとめてO(1)でクリアする
+        with self._result_cv:
+            self.result_queue.clear()
     
     def transcribe_file(self, 
                        file_path: str, 
@@ -252,26 +312,20 @@ class SpeechToTextStreaming:
         Returns:
             List[str]: 認識結果のリスト
         """
-        # 音声ファイルを読み込む
-        with open(file_path, "rb") as f:
-            audio_content = f.read()
-            
-        # チャンクに分割
-        chunk_length = len(audio_content) // 5
-        stream = [
-            audio_content[start : start + chunk_length]
-            for start in range(0, len(audio_content), chunk_length)
-        ]
-        
-        # 音声認識リクエストを作成
-        audio_requests = (
-            cloud_speech_types.StreamingRecognizeRequest(audio=audio) for audio in stream
-        )
-        
-        # リクエストを送信
+        # 音声ファイルはメモリマップして64KiBのフレームで逐次送信する。
+        # 全体をbytesに読み込んで等分スライスするとファイルの約2倍のメモリを
+        # 一時的に抱えるうえ、1リクエストが巨大になり最初の部分結果も遅くなる。
+        # memoryviewのスライスはマップ済み領域への参照で、protobufに渡す
+        # bytes(...)変換の分しかコピーしない
         def requests():
             yield self.config_request
-            yield from audio_requests
+            with open(file_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    for start in range(0, len(mm), FILE_CHUNK_BYTES):
+                        yield cloud_speech_types.StreamingRecognizeRequest(
+                            audio=bytes(view[start:start + FILE_CHUNK_BYTES])
+                        )
             
         # 音声認識を実行
         responses = self.client.streaming_recognize(requests=requests())
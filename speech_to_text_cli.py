@@ -5,11 +5,38 @@ import os
 import queue
 import threading
 import time
+import numpy as np
 from google.cloud import speech
 from google.cloud.speech_v1 import SpeechClient
 from google.auth import credentials
 from google.auth.transport import requests
 
+# 無音判定のしきい値（int16サンプルのRMS）。環境ノイズより十分上、
+# 小声の発話より十分下の経験値
+_VAD_RMS_THRESHOLD = 300
+# 無音がこのチャンク数（100ms単位）続くまでは送り続ける。発話末尾の
+# 無音はサーバー側のエンドポインティングに必要なので削らない
+_VAD_SILENCE_GRACE = 5
+# 無音を落としている間もこの間隔で1チャンクだけ通し、gRPCストリームの
+# タイムアウトを防ぐ（20チャンク=約2秒）
+_VAD_KEEPALIVE_EVERY = 20
+
+# プロジェクトIDごとに生成済みのSpeechClientを使い回す。クライアントは
+# gRPCチャネルを抱えており、作り直すたびにTLSハンドシェイクとHTTP/2
+# チャネル確立を払い直すことになる（認識再開時のコールドスタートの主因）
+_speech_clients = {}
+
+def _get_speech_client(project_id):
+    """SpeechClientをプロジェクトIDごとに1度だけ生成して返す"""
+    client = _speech_clients.get(project_id)
+    if client is None:
+        client_options = {"api_endpoint": "speech.googleapis.com:443"}
+        if project_id:
+            client_options["quota_project_id"] = project_id
+        client = SpeechClient(client_options=client_options)
+        _speech_clients[project_id] = client
+    return client
+
 class SpeechToTextCLI:
     """
     Google Cloud Speech-to-Textを使用した音声認識クラス（CLI用）
@@ -20,8 +47,18 @@ class SpeechToTextCLI:
         self.client = None
         self.streaming_config = None
         self.is_listening = False
-        self.audio_queue = queue.Queue()
+        # SimpleQueueはqueue.Queueと違い未処理数の追跡や全条件変数の起床を
+        # 行わないC実装で、100msごとのチャンク受け渡しのロック往復が軽い。
+        # 停止はタイムアウト付きgetのポーリングではなくNoneセンチネルで伝える
+        self.audio_queue = queue.SimpleQueue()
         self.transcript_thread = None
+        self._stop_event = threading.Event()
+        # streaming_recognizeの準備が整うまでに取り込んだ音声を捨てるためのゲート。
+        # チャネル確立前のチャンクを溜めても、開いた直後のストリームへ
+        # 滞留分が一気に流れて最初の認識結果を遅らせるだけになる
+        self._started = threading.Event()
+        # 連続して無音だったチャンク数（VAD用）
+        self._silence_streak = 0
     
     def set_callback(self, callback):
         """コールバック関数を設定"""
@@ -33,13 +70,22 @@ class SpeechToTextCLI:
             return
         
         self.is_listening = True
-        
-        # Speech-to-Text クライアントの初期化（プロジェクトIDを明示的に指定）
-        client_options = {"api_endpoint": "speech.googleapis.com:443"}
-        if self.project_id:
-            client_options["quota_project_id"] = self.project_id
-        
-        self.client = SpeechClient(client_options=client_options)
+        self._stop_event.clear()
+        self._started.clear()
+        self._silence_streak = 0
+
+        # 前回セッションの残留物（stop()の停止センチネルや、ストリームが
+        # サーバー側で閉じた後に消費されずに残った音声チャンク）を捨てる。
+        # センチネルが残っていると次のrequest_generatorが最初のgetで即終了する
+        while True:
+            try:
+                self.audio_queue.get_nowait()
+            except queue.Empty:
+                break
+
+        # Speech-to-Text クライアントの初期化
+        # （停止→再開しても温まったgRPCチャネルを使い回す）
+        self.client = _get_speech_client(self.project_id)
         
         # 設定
         config = speech.RecognitionConfig(
@@ -68,7 +114,39 @@ class SpeechToTextCLI:
     def stop(self):
         """音声認識を停止"""
         self.is_listening = False
+        self._stop_event.set()  # マイクスレッドを起こしてストリームを閉じさせる
+        self.audio_queue.put(None)  # ブロッキングget中のリクエスト生成器を起こす
     
+    def _pa_callback(self, in_data, frame_count, time_info, status):
+        """
+        PyAudioのコールバック（PortAudioのオーディオスレッドから呼ばれる）
+
+        受け取ったbytesをそのままキューに積む。コピーや変換を挟まないので、
+        protobufへ渡るまで音声データの複製は発生しない。
+        認識ストリームの準備が整う前のチャンクは読み捨てる。
+
+        短時間エネルギーによる簡易VADつき: 無音が続いている間はチャンクを
+        落とし、帯域とSpeech APIへの送信量を節約する。RMSの計算はNumPyの
+        ベクトル化に任せる（1600サンプルなら数マイクロ秒）。
+        """
+        if not self._started.is_set():
+            return (None, self._pa_continue)
+
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        # int16のまま二乗すると溢れるのでint64で二乗和を取る
+        mean_square = np.square(samples, dtype=np.int64).mean()
+        if mean_square < _VAD_RMS_THRESHOLD * _VAD_RMS_THRESHOLD:
+            self._silence_streak += 1
+            if (self._silence_streak > _VAD_SILENCE_GRACE
+                    and self._silence_streak % _VAD_KEEPALIVE_EVERY != 0):
+                # 長い無音の途中: キープアライブ以外は送らない
+                return (None, self._pa_continue)
+        else:
+            self._silence_streak = 0
+
+        self.audio_queue.put(in_data)
+        return (None, self._pa_continue)
+
     def _mic_thread(self):
         """マイクからの音声入力を処理するスレッド"""
         import pyaudio
@@ -79,18 +157,22 @@ class SpeechToTextCLI:
         CHANNELS = 1
         
         p = pyaudio.PyAudio()
+        self._pa_continue = pyaudio.paContinue  # コールバックの戻り値用
         
+        # コールバックモードで開く。ブロッキングreadのループでGILを握る
+        # 代わりに、PortAudio側のスレッドがチャンクの完成ごとに
+        # _pa_callbackへ配送する
         stream = p.open(
             format=FORMAT,
             channels=CHANNELS,
             rate=RATE,
             input=True,
-            frames_per_buffer=CHUNK
+            frames_per_buffer=CHUNK,
+            stream_callback=self._pa_callback
         )
         
-        while self.is_listening:
-            data = stream.read(CHUNK, exception_on_overflow=False)
-            self.audio_queue.put(data)
+        # 停止指示が来るまで待つだけ（音声はコールバック経由で流れ続ける）
+        self._stop_event.wait()
         
         stream.stop_stream()
         stream.close()
@@ -98,13 +180,34 @@ class SpeechToTextCLI:
     
     def _transcript_thread(self):
         """音声認識結果を処理するスレッド"""
+        # 1リクエストに相乗りさせる上限。gRPC送信のオーバーヘッドは減らしつつ、
+        # 溜め込みすぎて認識レイテンシを悪化させない程度に抑える
+        MAX_BATCH_CHUNKS = 4
+        MAX_BATCH_BYTES = 12800  # 16kHz/16bit mono で400ms相当
+
         def request_generator():
             while self.is_listening:
-                try:
-                    chunk = self.audio_queue.get(timeout=0.1)
-                    yield speech.StreamingRecognizeRequest(audio_content=chunk)
-                except queue.Empty:
-                    continue
+                chunk = self.audio_queue.get()
+                if chunk is None:
+                    # stop()が積む停止センチネル
+                    break
+                # キューに溜まっている分だけ待たずに相乗りさせる。
+                # 滞留がなければ1チャンクのまま即送るのでレイテンシは増えない
+                batch = [chunk]
+                size = len(chunk)
+                while len(batch) < MAX_BATCH_CHUNKS and size < MAX_BATCH_BYTES:
+                    try:
+                        chunk = self.audio_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if chunk is None:
+                        yield speech.StreamingRecognizeRequest(audio_content=b"".join(batch))
+                        return
+                    batch.append(chunk)
+                    size += len(chunk)
+                yield speech.StreamingRecognizeRequest(
+                    audio_content=batch[0] if len(batch) == 1 else b"".join(batch)
+                )
         
         try:
             responses = self.client.streaming_recognize(
@@ -112,6 +215,9 @@ class SpeechToTextCLI:
                 requests=request_generator()
             )
             
+            # ここからのコールバック分だけを送る（確立前の滞留音声は流さない）
+            self._started.set()
+            
             for response in responses:
                 if not response.results:
                     continue
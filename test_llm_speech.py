@@ -5,11 +5,14 @@ import os
 import time
 import threading
 import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 
 from dotenv import load_dotenv
 from speech_to_text import SpeechToTextStreaming
 from llm_manager import LLMManager
+from turn_parser import parse_turn_response
 
 # 環境変数の読み込み
 load_dotenv()
@@ -20,7 +23,9 @@ transcript_queue = queue.Queue()
 transcripts = []
 responses = []
 current_transcript = ""
-_accumulated_context = ""
+# 継続中の発言の断片。+=による文字列の再確保を避けるためリストで持ち、
+# LLMへ渡す直前に一度だけjoinする
+_accumulated_pieces = []
 
 # LLMのシステムプロンプト
 AIZUCHI_SYSTEM_PROMPT = """
@@ -61,6 +66,126 @@ TURN_DETECTION_PROMPT = """
 出力：{"continueConversation": false, "acknowledgement": "そうですね、とても良い天気です"}
 """
 
+# ターン判定結果のキャッシュ。ストリーミング認識では同じ短い発言
+# （「はい」「なるほど」など）が繰り返し確定するため、同一発言の分類に
+# LLM往復を払い直さない
+_turn_cache = OrderedDict()
+_TURN_CACHE_MAX = 1024
+
+def _check_turn_fast(transcript):
+    """
+    LLMを呼ばずにターン判定できる場合はその結果を返す
+
+    句点・疑問符で終わる発言は完結とみなし、同一発言の再判定は
+    キャッシュから返す。ここで判定がつけば投機的な応答生成も不要
+    （隠すべきLLM往復がない）なので、呼び出し側はNoneのときだけ
+    投機実行する。
+
+    Returns:
+        tuple: (会話継続か, 相槌や返事) / 判定できない場合はNone
+    """
+    key = transcript.strip()
+
+    # 明確な文末で終わる発言は完結。LLMに聞くまでもない
+    if key.endswith(("。", "？", "?")):
+        return False, "なるほど"
+
+    if key in _turn_cache:
+        _turn_cache.move_to_end(key)
+        return _turn_cache[key]
+
+    return None
+
+def _check_turn_llm(transcript, llm_manager):
+    """
+    ターン判定LLMを呼び出して判定し、解析に成功した結果をキャッシュする
+
+    Returns:
+        tuple: (会話継続か, 相槌や返事)
+    """
+    key = transcript.strip()
+
+    # ストリーミングで受け取り、JSONオブジェクトが閉じた時点で打ち切る。
+    # 判定ペイロードは2フィールドの小さなJSONなので、モデルが後ろに
+    # 余計なテキストを続けてもその生成完了を待つ必要はない
+    state = {"depth": 0, "in_string": False, "escape": False, "open": False}
+
+    def _on_turn_chunk(chunk):
+        # 波括弧の深さを進める（文字列リテラル内の括弧とエスケープは無視）
+        for ch in chunk:
+            if state["in_string"]:
+                if state["escape"]:
+                    state["escape"] = False
+                elif ch == "\\":
+                    state["escape"] = True
+                elif ch == '"':
+                    state["in_string"] = False
+            elif ch == '"':
+                state["in_string"] = True
+            elif ch == "{":
+                state["depth"] += 1
+                state["open"] = True
+            elif ch == "}":
+                state["depth"] -= 1
+                if state["open"] and state["depth"] == 0:
+                    # JSONが閉じた。残りのストリームは読まない
+                    return False
+        return True
+
+    turn_response = llm_manager.call_model(
+        prompt=transcript,
+        system_prompt=TURN_DETECTION_PROMPT,
+        model="gemini-2.0-flash",
+        stream=True,
+        stream_callback=_on_turn_chunk
+    )
+    print(f"ターン判定結果: {turn_response}")
+
+    continue_conversation, ack, parsed = parse_turn_response(
+        turn_response, default_continue=False
+    )
+    if parsed:
+        # 解析に成功した結果だけキャッシュする
+        _turn_cache[key] = (continue_conversation, ack)
+        if len(_turn_cache) > _TURN_CACHE_MAX:
+            _turn_cache.popitem(last=False)
+
+    return continue_conversation, ack
+
+# 投機的な応答生成用のエグゼキュータ（ターン判定と本応答のLLM呼び出しを重ねる）
+_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm")
+
+def _generate_full_response(llm_manager, prompt, print_event):
+    """
+    完全応答をストリーミング生成する（ブロッキング）
+
+    ターン判定の確定前は投機的な生成なので出力しない。print_eventが
+    セットされたら未出力分をまとめて吐き出し、以降は到着順に流す。
+    """
+    parts = []
+    printed = [0]  # 出力済みチャンク数（クロージャから更新するためリストで持つ）
+
+    def on_chunk(chunk):
+        parts.append(chunk)
+        if print_event.is_set():
+            print("".join(parts[printed[0]:]), end="", flush=True)
+            printed[0] = len(parts)
+
+    response = llm_manager.call_model(
+        prompt=prompt,
+        system_prompt=CONVERSATION_SYSTEM_PROMPT,
+        model="gemini-2.0-flash",
+        stream=True,
+        stream_callback=on_chunk
+    )
+
+    # 判定確定より先に生成が終わった場合、未出力分をここで流す
+    if print_event.is_set() and printed[0] < len(parts):
+        print("".join(parts[printed[0]:]), end="", flush=True)
+        printed[0] = len(parts)
+
+    return response
+
 def initialize_stt():
     """
     Speech-to-Textの初期化
@@ -96,6 +221,11 @@ def initialize_llm():
         print(f"LLMの初期化中にエラーが発生しました: {str(e)}")
         return None
 
+# 中間結果の表示間隔（秒）。中間結果は数十msごとに届くことがあり、
+# 毎回flushすると端末I/Oだけでコールバックが詰まる
+_INTERIM_PRINT_INTERVAL = 0.1
+_last_interim_print = 0.0
+
 def on_speech_result(transcript: str, is_final: bool):
     """
     音声認識結果を受け取るコールバック関数
@@ -104,16 +234,19 @@ def on_speech_result(transcript: str, is_final: bool):
         transcript: 認識されたテキスト
         is_final: 最終結果かどうか
     """
-    global transcript_queue, current_transcript
+    global transcript_queue, current_transcript, _last_interim_print
     
     # 現在の文字起こしを更新
     current_transcript = transcript
     
-    # ログ出力
+    # ログ出力（中間結果は間引き、最終結果は必ず表示する）
     if is_final:
         print(f"音声認識結果（最終）: {transcript}")
     else:
-        print(f"音声認識結果（中間）: {transcript}", end="\r")
+        now = time.monotonic()
+        if now - _last_interim_print >= _INTERIM_PRINT_INTERVAL:
+            _last_interim_print = now
+            print(f"音声認識結果（中間）: {transcript}", end="\r")
     
     # 最終結果の場合はキューに追加
     if is_final and transcript.strip():
@@ -123,97 +256,79 @@ def process_transcripts(llm_manager):
     """
     音声認識結果を処理するスレッド関数
     """
-    global is_listening, transcript_queue, transcripts, responses, _accumulated_context
+    global is_listening, transcript_queue, transcripts, responses
     
     print("文字起こし処理スレッドを開始します。")
-    import json
-    import re
     
     while is_listening:
         try:
             # キューから文字起こしを取得
-            if not transcript_queue.empty():
-                transcript = transcript_queue.get(timeout=0.1)
-                print(f"キューから取得した文字起こし: {transcript}")
+            # ブロッキングでキューを待つ（空の間はポーリングせず休眠する）。
+            # timeoutはis_listeningの変化を拾うための定期的な目覚ましにすぎない
+            transcript = transcript_queue.get(timeout=1.0)
+            print(f"キューから取得した文字起こし: {transcript}")
                 
-                # Call LLM to decide turn-taking using TURN_DETECTION_PROMPT
-                turn_response = llm_manager.call_model(
-                    prompt=transcript,
-                    system_prompt=TURN_DETECTION_PROMPT,
-                    model="gemini-2.0-flash",
-                    stream=False
+            combined_prompt = " ".join(_accumulated_pieces + [transcript]) if _accumulated_pieces else transcript
+            print_event = threading.Event()
+            speculative = None
+
+            # ルール・キャッシュで即決できる発言は投機的生成を起動しない
+            # （相槌で終わる発言のたびに破棄前提のLLM呼び出しを発行すると
+            # エグゼキュータのワーカーを無駄に塞ぐ）
+            fast_result = _check_turn_fast(transcript)
+            if fast_result is not None:
+                continue_conversation, ack = fast_result
+            else:
+                # 曖昧な発言のみ: 本応答の生成を投機的に開始しつつ、ターン判定を
+                # 実行する。「会話完了」なら判定の待ちが生成の裏に隠れ、ユーザーの
+                # 待ちはmax(判定, 生成)になる。「会話継続」なら投機分は破棄する
+                speculative = _EXEC.submit(
+                    _generate_full_response, llm_manager, combined_prompt, print_event
                 )
-                print(f"ターン判定結果: {turn_response}")
-                
-                # Parse JSON from turn_response
-                try:
-                    # Extract JSON using regex in case LLM includes other text
-                    json_match = re.search(r'\{.*\}', turn_response, re.DOTALL)
-                    if json_match:
-                        json_str = json_match.group(0)
-                        turn_data = json.loads(json_str)
-                        continue_conversation = turn_data.get("continueConversation", False)
-                        ack = turn_data.get("acknowledgement", "なるほど")
-                    else:
-                        # Fallback if no JSON found
-                        continue_conversation = "continueConversation\": true" in turn_response
-                        ack = "なるほど"
-                        if "acknowledgement\":" in turn_response:
-                            ack_match = re.search(r'acknowledgement\":\s*\"([^\"]+)', turn_response)
-                            if ack_match:
-                                ack = ack_match.group(1)
-                except json.JSONDecodeError:
-                    # Fallback if JSON parsing fails
-                    continue_conversation = "continueConversation\": true" in turn_response
-                    ack = "なるほど"
-                    if "acknowledgement\":" in turn_response:
-                        ack_match = re.search(r'acknowledgement\":\s*\"([^\"]+)', turn_response)
-                        if ack_match:
-                            ack = ack_match.group(1)
-                
-                print(f"解析結果: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
+                continue_conversation, ack = _check_turn_llm(transcript, llm_manager)
+
+            print(f"解析結果: 会話継続={continue_conversation}, 相槌=\"{ack}\"")
                 
-                if continue_conversation:
-                    # User is still talking: accumulate transcript and provide acknowledgement
-                    _accumulated_context += " " + transcript
-                    responses.append(ack)
-                    transcripts.append(transcript)
-                    # Simulate streaming response by printing each character with slight delay
-                    print("相槌を返します: ", end="", flush=True)
-                    for char in ack:
-                        print(char, end="", flush=True)
-                        time.sleep(0.01)
-                    print()  # new line after ack
-                    print(f"蓄積内容: {_accumulated_context}")
+            if continue_conversation:
+                # 会話継続：投機的な生成は破棄して相槌だけ返す
+                if speculative is not None:
+                    speculative.cancel()
+                # User is still talking: accumulate transcript and provide acknowledgement
+                _accumulated_pieces.append(transcript)
+                # 蓄積コンテキストは無制限に伸ばさない（LLM入力サイズを抑えるため末尾のみ保持）
+                while sum(map(len, _accumulated_pieces)) > 2000 and len(_accumulated_pieces) > 1:
+                    _accumulated_pieces.pop(0)
+                responses.append(ack)
+                transcripts.append(transcript)
+                # 相槌は短いので疑似ストリーミングせず一括で表示する
+                print(f"相槌を返します: {ack}", flush=True)
+                print(f"蓄積内容: {' '.join(_accumulated_pieces)}")
+            else:
+                # User has completed their turn: use the speculative response
+                print(f"完全な応答を生成します: 入力=\"{combined_prompt}\"")
+                print_event.set()  # 以降のチャンクを到着順に出力する許可
+                if speculative is not None:
+                    full_response = speculative.result()
                 else:
-                    # User has completed their turn: generate full response
-                    combined_prompt = _accumulated_context + " " + transcript if _accumulated_context else transcript
-                    print(f"完全な応答を生成します: 入力=\"{combined_prompt}\"")
-                    full_response = llm_manager.call_model(
-                        prompt=combined_prompt,
-                        system_prompt=CONVERSATION_SYSTEM_PROMPT,
-                        model="gemini-2.0-flash",
-                        stream=True,
-                        stream_callback=lambda chunk: (print(chunk, end="", flush=True), time.sleep(0.01))
+                    # 即決判定のため投機実行していない: ここで生成する
+                    full_response = _generate_full_response(
+                        llm_manager, combined_prompt, print_event
                     )
-                    print()  # new line after response
-                    responses.append(full_response)
-                    transcripts.append(combined_prompt)
-                    _accumulated_context = ""  # clear accumulated context
+                print()  # new line after response
+                responses.append(full_response)
+                transcripts.append(combined_prompt)
+                _accumulated_pieces.clear()  # clear accumulated context
                 
-                # Display conversation history
-                print("\n===== 会話履歴 =====")
-                for i, (t, r) in enumerate(zip(transcripts, responses)):
-                    print(f"あなた: {t}")
-                    print(f"AI: {r}")
-                    if i < len(transcripts) - 1:
-                        print("-" * 30)
-                print("=" * 20)
-            
-            # 少し待機
-            time.sleep(0.1)
+            # Display conversation history
+            print("\n===== 会話履歴 =====")
+            for i, (t, r) in enumerate(zip(transcripts, responses)):
+                print(f"あなた: {t}")
+                print(f"AI: {r}")
+                if i < len(transcripts) - 1:
+                    print("-" * 30)
+            print("=" * 20)
         except queue.Empty:
-            time.sleep(0.1)
+            continue
         except Exception as e:
             print(f"文字起こしの処理中にエラーが発生しました: {str(e)}")
             import traceback
@@ -288,14 +403,14 @@ def clear_history():
     """
     会話履歴をクリアする
     """
-    global transcript_queue, transcripts, responses, current_transcript, _accumulated_context
+    global transcript_queue, transcripts, responses, current_transcript
     
     print("会話履歴をクリアします。")
     
     transcripts.clear()
     responses.clear()
     current_transcript = ""
-    _accumulated_context = ""  # 蓄積コンテキストもクリア
+    _accumulated_pieces.clear()  # 蓄積コンテキストもクリア
     
     # キューをクリア
     while not transcript_queue.empty():
@@ -363,12 +478,17 @@ def test_speech_to_text():
     
     # コールバック関数
     results = []
+    last_interim = [0.0]
     def callback(transcript, is_final):
         if is_final:
             print(f"音声認識結果（最終）: {transcript}")
             results.append(transcript)
         else:
-            print(f"音声認識結果（中間）: {transcript}", end="\r")
+            # 中間結果は0.1秒間隔に間引く（最終結果は常に表示）
+            now = time.monotonic()
+            if now - last_interim[0] >= 0.1:
+                last_interim[0] = now
+                print(f"音声認識結果（中間）: {transcript}", end="\r")
     
     # 音声認識を開始
     stt.start_listening(callback=callback)
@@ -3,8 +3,8 @@ Google Cloud Speech-to-Text APIのテストスクリプト
 """
 import os
 import time
-import json
-import re
+import queue
+import numpy as np
 from dotenv import load_dotenv
 from google.cloud.speech_v2 import SpeechClient
 from google.cloud.speech_v2.types import cloud_speech as cloud_speech_types
@@ -20,32 +20,13 @@ CHUNK = int(RATE / 10)  # 100ms
 LANGUAGE_CODE = "ja-JP"  # 日本語
 
 # LLMのシステムプロンプト
-TURN_DETECTION_PROMPT = """
-あなたはユーザーの発言を分析し、会話の流れを判断するアシスタントです。
-ユーザーの発言が会話の途中であるか完了しているかを判断し、適切な応答方法を決定してください。
-
-以下のJSON形式のみで出力してください。他の説明は一切不要です。
-{
-  "continueConversation": true または false,
-  "acknowledgement": "適切な短い相槌や返事"
-}
-
-- continueConversation: 
-  - true: ユーザーの発言が一時停止しているが、まだ発言の途中で続きが予想される場合
-  - false: ユーザーの発言が完結していて、AIが応答すべき場合
-
-- acknowledgement:
-  - continueConversationがtrueの場合: "なるほど", "はい", "ええ" などの非常に短い相槌
-  - continueConversationがfalseの場合: ユーザーの発言に対する適切な応答
-"""
-
 CONVERSATION_SYSTEM_PROMPT = """
 あなたは会話の相手です。ユーザーの発言に対して、自然な会話を続けるように返答してください。
 質問には答え、意見には共感や別の視点を提供し、会話を発展させてください。
 返答は簡潔で自然な会話調にしてください。
 """
 
-# 新しい関数：LLMを初期化する
+# LLMを初期化する
 def initialize_llm():
     """
     LLMの初期化
@@ -59,51 +40,6 @@ def initialize_llm():
         print(f"LLMの初期化中にエラーが発生しました: {str(e)}")
         return None
 
-# 新しい関数：LLMを使用してターン判定を行う
-def check_turn_taking(text, llm_manager):
-    """
-    LLMを使用してターン判定を行う
-    
-    Args:
-        text: 判定するテキスト
-        llm_manager: LLMマネージャー
-        
-    Returns:
-        tuple: (会話継続か, 相槌や返事)
-    """
-    if not llm_manager:
-        # LLMマネージャーがない場合はデフォルト値を返す
-        return True, "はい"
-    
-    try:
-        turn_response = llm_manager.call_model(
-            prompt=text,
-            system_prompt=TURN_DETECTION_PROMPT,
-            model="gemini-2.0-flash",
-            stream=False
-        )
-        print(f"ターン判定結果: {turn_response}")
-        
-        # JSONを解析
-        try:
-            # 正規表現でJSONを抽出（LLMが余計なテキストを含む場合）
-            json_match = re.search(r'\{.*\}', turn_response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                turn_data = json.loads(json_str)
-                continue_conversation = turn_data.get("continueConversation", True)
-                ack = turn_data.get("acknowledgement", "なるほど")
-                return continue_conversation, ack
-            else:
-                # JSONが見つからない場合はデフォルト値を返す
-                return True, "なるほど"
-        except json.JSONDecodeError:
-            # JSON解析エラーの場合はデフォルト値を返す
-            return True, "なるほど"
-    except Exception as e:
-        print(f"ターン判定中にエラーが発生しました: {str(e)}")
-        return True, "なるほど"
-
 # test_speech_apiを拡張
 def test_speech_api():
     """
@@ -121,7 +57,10 @@ def test_speech_api():
     
     # 蓄積されたコンテキスト
     accumulated_context = ""
-    
+
+    # 中間結果を最後に表示した時刻（間引き用）
+    last_interim_print = 0.0
+
     try:
         # クライアントの初期化
         client = SpeechClient()
@@ -172,11 +111,13 @@ def test_speech_api():
                 
                 print("マイクストリームを開きました。5秒間録音します...")
                 
-                # 5秒間録音
-                frames = []
-                for i in range(0, int(RATE / CHUNK * 5)):
+                # 5秒間録音。固定サイズのint16バッファを先に確保し、
+                # チャンクごとのbytes蓄積と最後のjoinコピーを省く
+                num_chunks = int(RATE / CHUNK * 5)
+                buf = np.empty(num_chunks * CHUNK, dtype=np.int16)
+                for i in range(num_chunks):
                     data = stream.read(CHUNK, exception_on_overflow=False)
-                    frames.append(data)
+                    buf[i * CHUNK:(i + 1) * CHUNK] = np.frombuffer(data, dtype=np.int16)
                     # 進捗表示
                     if i % 10 == 0:
                         print(".", end="", flush=True)
@@ -188,8 +129,8 @@ def test_speech_api():
                 stream.close()
                 audio.terminate()
                 
-                # 録音データを結合
-                audio_content = b''.join(frames)
+                # 連続バッファなのでbytes化は1回のコピーで済む
+                audio_content = buf.tobytes()
                 
                 print(f"録音データのサイズ: {len(audio_content)} バイト")
                 
@@ -217,9 +158,14 @@ def test_speech_api():
             
             elif mode == "2":
                 # リアルタイム音声認識とターン判定テスト
-                # ストリーミング設定
+                # ストリーミング設定。サーバー側VADの発話終了イベントを有効にし、
+                # ターン終了の判定をGeminiへの往復なしで受け取る
                 streaming_config = cloud_speech_types.StreamingRecognitionConfig(
-                    config=recognition_config
+                    config=recognition_config,
+                    streaming_features=cloud_speech_types.StreamingRecognitionFeatures(
+                        interim_results=True,
+                        enable_voice_activity_events=True,
+                    ),
                 )
                 
                 # 設定リクエスト
@@ -228,13 +174,22 @@ def test_speech_api():
                     streaming_config=streaming_config,
                 )
                 
-                # マイクストリームを開く
+                # マイクストリームを開く（コールバックモード：Pythonスレッドが
+                # ブロッキングreadでGILを握る代わりに、PortAudioのスレッドが
+                # 完成したチャンクをキューへ配送する）
+                audio_q = queue.SimpleQueue()
+                
+                def pa_callback(in_data, frame_count, time_info, status):
+                    audio_q.put(in_data)
+                    return (None, pyaudio.paContinue)
+                
                 stream = audio.open(
                     format=pyaudio.paInt16,
                     channels=1,
                     rate=RATE,
                     input=True,
                     frames_per_buffer=CHUNK,
+                    stream_callback=pa_callback,
                 )
                 
                 print("\nリアルタイム音声認識を開始します。終了するには Ctrl+C を押してください...")
@@ -242,8 +197,7 @@ def test_speech_api():
                 # 音声生成ジェネレータ
                 def audio_generator():
                     while True:
-                        data = stream.read(CHUNK, exception_on_overflow=False)
-                        yield data
+                        yield audio_q.get()
                 
                 # リクエスト生成ジェネレータ
                 def request_generator():
@@ -261,7 +215,33 @@ def test_speech_api():
                         requests=request_generator()
                     )
                     
+                    # サーバーVADの発話終了イベントが最終結果より先に届くことが
+                    # あるため、イベントだけ先着した場合はフラグを立てておき、
+                    # 対応する最終結果が届いた時点で応答を生成する
+                    _SPEECH_END = cloud_speech_types.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_END
+                    turn_closed = False
+                    
+                    def generate_full_response(prompt):
+                        print(f"完全な応答を生成します。入力=\"{prompt}\"")
+                        full = llm.call_model(
+                            prompt=prompt,
+                            system_prompt=CONVERSATION_SYSTEM_PROMPT,
+                            model="gemini-2.0-flash"
+                        )
+                        print(f"LLMの応答: {full}")
+                    
                     for response in responses:
+                        # サーバー側VADイベント（ターン終了の合図）。
+                        # ここを使うことでターン判定用のLLM往復を丸ごと省ける
+                        if response.speech_event_type == _SPEECH_END:
+                            print("\nサーバーVAD: 発話終了を検出")
+                            if llm and accumulated_context:
+                                generate_full_response(accumulated_context.strip())
+                                accumulated_context = ""
+                            else:
+                                turn_closed = True
+                            continue
+                        
                         if not response.results:
                             continue
                             
@@ -278,30 +258,24 @@ def test_speech_api():
                             if is_final:
                                 print(f"\n音声認識結果（最終）: {transcript}")
                                 
-                                # ターン判定
                                 if llm:
-                                    continue_conv, ack = check_turn_taking(transcript, llm)
-                                    print(f"ターン判定: 会話継続={continue_conv}, 相槌=\"{ack}\"")
-                                    
-                                    if continue_conv:
-                                        # ユーザーがまだ話している: コンテキストを蓄積して相槌
-                                        accumulated_context += " " + transcript
-                                        print(f"相槌を返します: {ack}")
-                                        print(f"蓄積コンテキスト: {accumulated_context}")
-                                    else:
-                                        # ユーザーの発言が完了: フル応答を生成
-                                        combined_prompt = accumulated_context + " " + transcript if accumulated_context else transcript
-                                        print(f"完全な応答を生成します。入力=\"{combined_prompt}\"")
-                                        if llm:
-                                            response = llm.call_model(
-                                                prompt=combined_prompt,
-                                                system_prompt=CONVERSATION_SYSTEM_PROMPT,
-                                                model="gemini-2.0-flash"
-                                            )
-                                            print(f"LLMの応答: {response}")
+                                    accumulated_context += " " + transcript
+                                    if turn_closed:
+                                        # VADイベントが先着済み: このターンは完了
+                                        turn_closed = False
+                                        generate_full_response(accumulated_context.strip())
                                         accumulated_context = ""  # 蓄積コンテキストをクリア
+                                    else:
+                                        # まだ発話中: 固定の相槌だけ返して蓄積する
+                                        print("相槌を返します: なるほど")
+                                        print(f"蓄積コンテキスト: {accumulated_context}")
                             else:
-                                print(f"音声認識結果（中間）: {transcript}", end="\r")
+                                # 中間結果は0.1秒間隔に間引いて表示する
+                                # （毎回flushすると端末I/Oで応答ループが詰まる）
+                                now = time.monotonic()
+                                if now - last_interim_print >= 0.1:
+                                    last_interim_print = now
+                                    print(f"音声認識結果（中間）: {transcript}", end="\r")
                 except KeyboardInterrupt:
                     print("\n\nリアルタイム音声認識を終了します...")
                 finally:
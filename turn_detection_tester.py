@@ -4,15 +4,48 @@
 import os
 import re
 import json
+import html
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from itertools import islice
 import streamlit as st
 from dotenv import load_dotenv
 
 # LLMマネージャーをインポート
-from llm_manager import LLMManager
+from llm_manager import LLMManager, LLM_TIMEOUT_MESSAGE
+from turn_parser import find_json_span
 
 # 環境変数の読み込み
 load_dotenv()
 
+# 判定呼び出し用のエグゼキュータ。ストリーミング中もUIスレッドを空けて
+# おき、相槌フィールドが閉じた時点で先行表示できるようにする
+_JUDGE_EXEC = ThreadPoolExecutor(max_workers=2, thread_name_prefix="judge")
+
+# 応答全体を待つ上限（秒）。超えたらヒューリスティックに切り替える
+_JUDGE_DEADLINE_SEC = 10.0
+
+# 保持する判定履歴の上限と、画面に出す件数
+_HISTORY_MAX = 100
+_HISTORY_SHOWN = 10
+
+# 応答解析用の正規表現（モジュール読み込み時に1度だけコンパイルする）
+_RE_CONT = re.compile(r'"continueConversation"\s*:\s*(true|false)')
+_RE_ACK = re.compile(r'"acknowledgement"\s*:\s*"([^"]+)"')
+_RE_REASON = re.compile(r'"reason"\s*:\s*"([^"]+)"')
+_RE_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_RE_PY_LITERAL = re.compile(r"\b(True|False|None)\b")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+# ヒューリスティック判定用のマーカー（タプルにしておくとendswithがC実装の
+# 一括判定になり、呼び出しごとのリスト構築もなくなる）
+_INCOMPLETE_MARKERS = ("は", "が", "けど", "って", "とか", "ので", "から")
+_ENDING_PARTICLES = ("ね", "よ", "な", "わ", "ぞ", "ぜ", "のだ", "んだ")
+# 疑問語は1本のオルタネーションにまとめ、C実装のマッチャが1回の走査で
+# 判定できるようにする（語ごとのin検索は発言を8回舐める）
+_QUESTION_RE = re.compile("何|どう|なぜ|いつ|どこ|だれ|誰|ですか")
+
 # ターン判定用のプロンプト
 TURN_DETECTION_PROMPT = """
 あなたはユーザーの発言を分析し、会話の流れを判断するアシスタントです。
@@ -44,34 +77,111 @@ TURN_DETECTION_PROMPT = """
 出力：{"continueConversation": false, "acknowledgement": "そうですね、とても良い天気です", "reason": "完結した文で意見が述べられている"}
 """
 
+# 結果表示用のCSSとカードのテンプレート。再実行のたびに文字列を組み直さず、
+# モジュール定数を使い回す（StreamlitはウィジェットのたびにNoneでなく
+# main()全体を再実行するため、この組み立てが毎回走る）
+_CSS_BLOCK = """
+<style>
+.result-card {
+    border-radius: 10px;
+    padding: 20px;
+    margin-bottom: 20px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+}
+.continue-true {
+    background-color: #d1e7dd;
+    border-left: 5px solid #198754;
+}
+.continue-false {
+    background-color: #f8d7da;
+    border-left: 5px solid #dc3545;
+}
+.comparison-card {
+    background-color: #e2e3e5;
+    border-left: 5px solid #6c757d;
+}
+</style>
+"""
+
+_RESULT_CARD_TPL = """
+<div class="result-card {cls}">
+    <h3>{head}</h3>
+    <p><strong>相槌/応答:</strong> {ack}</p>
+    <p><strong>判断理由:</strong> {reason}</p>
+    <p><strong>解析方法:</strong> {method}</p>
+</div>
+"""
+
+_COMPARISON_CARD_TPL = """
+<div class="result-card comparison-card">
+    <h4>{head}</h4>
+    <p><strong>ヒューリスティック判定:</strong> {verdict}</p>
+    <p><strong>理由:</strong> {reason}</p>
+</div>
+"""
+
+def _repair_json(s):
+    """
+    ほぼ正しいJSONの典型的な崩れを修復する
+
+    LLMはPythonリテラル（True/False/None）、末尾カンマ、シングルクォート、
+    Markdownのコードフェンスを混ぜてくることがある。正規表現への
+    フォールバックで情報を落とす前に、文字列処理だけで直せるものは直す。
+    """
+    s = s.strip()
+    # ```json ... ``` のフェンスを剥がす
+    if s.startswith("```"):
+        s = s.split("\n", 1)[1] if "\n" in s else s[3:]
+        if s.endswith("```"):
+            s = s[:-3]
+        s = s.strip()
+    # 末尾カンマとPythonリテラル
+    s = _RE_TRAILING_COMMA.sub(r"\1", s)
+    s = _RE_PY_LITERAL.sub(lambda m: _PY_LITERALS[m.group(1)], s)
+    # ダブルクォート文字列の外にあるシングルクォートだけ置換する
+    out = []
+    in_double = False
+    escape = False
+    for ch in s:
+        if in_double:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_double = False
+        elif ch == '"':
+            in_double = True
+        elif ch == "'":
+            ch = '"'
+        out.append(ch)
+    return "".join(out)
+
 def backup_heuristic_analysis(text):
     """
     バックアップヒューリスティック分析（LLM解析が失敗した場合）
     """
-    # 日本語用の簡易ヒューリスティック
-    has_question_mark = "?" in text or "？" in text
-    is_short = len(text.strip()) < 10
-    likely_question = any(q in text for q in ["何", "どう", "なぜ", "いつ", "どこ", "だれ", "誰", "ですか"])
-    
-    # 未完了文のチェック
-    incomplete_markers = ["は", "が", "けど", "って", "とか", "ので", "から"]
-    ends_with_incomplete = any(text.strip().endswith(marker) for marker in incomplete_markers)
-    
-    # 文末表現のチェック
-    ending_particles = ["ね", "よ", "な", "わ", "ぞ", "ぜ", "のだ", "んだ"]
-    has_ending_particle = any(text.strip().endswith(particle) for particle in ending_particles)
+    # 日本語用の簡易ヒューリスティック。stripとlenは1回だけ計算し、
+    # O(1)の文末疑問符チェックを先頭に置いて安い順に評価・打ち切りする
+    s = text.strip()
+    n = len(s)
     
     # 判断ロジック
-    if has_question_mark or likely_question:
+    if not n:
+        # 空入力は従来どおり「短い発言」扱い（会話継続）にする
+        continue_conversation = True
+        reason = "短い発言で文末表現がありません"
+    elif s[-1] in "?？" or "?" in s or "？" in s or _QUESTION_RE.search(s):
         continue_conversation = False
         reason = "質問文が検出されました"
-    elif ends_with_incomplete:
+    elif s.endswith(_INCOMPLETE_MARKERS):
         continue_conversation = True
         reason = "未完了の文が検出されました"
-    elif has_ending_particle:
+    elif s.endswith(_ENDING_PARTICLES):
         continue_conversation = False
         reason = "文末表現が検出されました"
-    elif is_short and not has_ending_particle:
+    elif n < 10:
+        # この分岐に来た時点で文末表現がないことは確定している
         continue_conversation = True
         reason = "短い発言で文末表現がありません"
     else:
@@ -99,20 +209,27 @@ def parse_llm_response(response_text):
     try:
         # まず直接JSONとして解析
         try:
-            # 応答からJSONパターンを探す
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                data = json.loads(json_str)
-                data["method"] = "JSON正常解析"
-                return data
+            # 応答からJSONオブジェクトを切り出す（波括弧の深さを数える走査。
+            # DOTALL付き{.*}はネストや複数オブジェクトで余計に取り込む）
+            json_str = find_json_span(response_text)
+            if json_str:
+                try:
+                    data = json.loads(json_str)
+                    data["method"] = "JSON正常解析"
+                    return data
+                except json.JSONDecodeError:
+                    # 軽微な崩れを修復して再挑戦する（LLMを呼び直すより
+                    # 3桁安く、正規表現フォールバックはreason等を落とす）
+                    data = json.loads(_repair_json(json_str))
+                    data["method"] = "JSON修復解析"
+                    return data
         except json.JSONDecodeError:
             pass
         
         # 正規表現で個別にフィールドを抽出
-        continue_match = re.search(r'"continueConversation"\s*:\s*(true|false)', response_text)
-        ack_match = re.search(r'"acknowledgement"\s*:\s*"([^"]+)"', response_text)
-        reason_match = re.search(r'"reason"\s*:\s*"([^"]+)"', response_text)
+        continue_match = _RE_CONT.search(response_text)
+        ack_match = _RE_ACK.search(response_text)
+        reason_match = _RE_REASON.search(response_text)
         
         if continue_match and ack_match:
             continue_conversation = continue_match.group(1).lower() == "true"
@@ -203,26 +320,64 @@ def main():
                 st.warning("テキストを入力してください。")
             else:
                 st.session_state.user_input = user_input  # 再利用のために保存
+                ack_placeholder = st.empty()
                 with st.spinner("判定中..."):
-                    # ターン判定用のLLM呼び出し
-                    raw_response = st.session_state.llm.call_model(
+                    # ターン判定をストリーミングで呼び出す。チャンクを溜めつつ
+                    # acknowledgementフィールドが閉じた時点を検出し、JSON全体の
+                    # 生成完了を待たずに相槌だけ先に見せる
+                    parts = []
+                    found_ack = {"value": None}
+                    
+                    def _on_judge_chunk(chunk):
+                        parts.append(chunk)
+                        if found_ack["value"] is None:
+                            ack_match = _RE_ACK.search("".join(parts))
+                            if ack_match:
+                                found_ack["value"] = ack_match.group(1)
+                        return True
+                    
+                    future = _JUDGE_EXEC.submit(
+                        st.session_state.llm.call_model,
                         prompt=user_input,
                         system_prompt=TURN_DETECTION_PROMPT,
                         model=model,
-                        stream=False
+                        stream=True,
+                        stream_callback=_on_judge_chunk
                     )
                     
-                    # 応答の解析
-                    parsed_result = parse_llm_response(raw_response)
+                    # UIスレッドは小刻みに待ち、相槌が届いたら先行表示する
+                    # （st.*はこのスレッドからしか触れない）
+                    raw_response = None
+                    ack_shown = False
+                    judge_deadline = time.monotonic() + _JUDGE_DEADLINE_SEC
+                    while True:
+                        try:
+                            raw_response = future.result(timeout=0.1)
+                            break
+                        except FuturesTimeout:
+                            if found_ack["value"] and not ack_shown:
+                                ack_placeholder.info(f"相槌（先行表示）: {found_ack['value']}")
+                                ack_shown = True
+                            if time.monotonic() > judge_deadline:
+                                break
                     
+                    # 応答の解析（期限切れなら入力のヒューリスティックで代替）
+                    if raw_response is None:
+                        raw_response = "".join(parts) or LLM_TIMEOUT_MESSAGE
+                        parsed_result = backup_heuristic_analysis(user_input)
+                    else:
+                        parsed_result = parse_llm_response(raw_response)
+
                     # 比較用にバックアップヒューリスティックも実行
                     backup_result = backup_heuristic_analysis(user_input)
-                    
+
                     # 結果をセッション状態に保存
                     st.session_state.raw_response = raw_response
                     st.session_state.parsed_result = parsed_result
                     st.session_state.backup_result = backup_result
-                
+
+                # 先行表示は最終結果の描画と重複するので消す
+                ack_placeholder.empty()
                 st.success("判定完了")
         
         # クリアボタン
@@ -250,59 +405,42 @@ def main():
         st.subheader("判定結果")
         
         if "parsed_result" in st.session_state:
+            # session_stateの読み取りはプロキシ経由の辞書引きで、Streamlitは
+            # 操作のたびにmain()全体を再実行する。繰り返し参照する値は
+            # ローカルへ1度だけ写す
+            parsed_result = st.session_state.parsed_result
+            backup_result = st.session_state.backup_result
+            
             # 結果を視覚的に魅力的な方法で表示
-            continue_conv = st.session_state.parsed_result.get("continueConversation", False)
+            continue_conv = parsed_result.get("continueConversation", False)
             
-            # カードスタイルの結果表示用CSS
-            st.markdown("""
-            <style>
-            .result-card {
-                border-radius: 10px;
-                padding: 20px;
-                margin-bottom: 20px;
-                box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-            }
-            .continue-true {
-                background-color: #d1e7dd;
-                border-left: 5px solid #198754;
-            }
-            .continue-false {
-                background-color: #f8d7da;
-                border-left: 5px solid #dc3545;
-            }
-            .comparison-card {
-                background-color: #e2e3e5;
-                border-left: 5px solid #6c757d;
-            }
-            </style>
-            """, unsafe_allow_html=True)
+            # カードスタイルの結果表示用CSS（Streamlitは再実行で出し直さない
+            # 要素が消えるため、毎回出すがモジュール定数をそのまま使う）
+            st.markdown(_CSS_BLOCK, unsafe_allow_html=True)
             
             # メイン結果
             st.markdown(
-                f"""
-                <div class="result-card {'continue-true' if continue_conv else 'continue-false'}">
-                    <h3>{'✅ 会話継続' if continue_conv else '🛑 会話完了'}</h3>
-                    <p><strong>相槌/応答:</strong> {st.session_state.parsed_result.get('acknowledgement', 'なし')}</p>
-                    <p><strong>判断理由:</strong> {st.session_state.parsed_result.get('reason', 'なし')}</p>
-                    <p><strong>解析方法:</strong> {st.session_state.parsed_result.get('method', 'なし')}</p>
-                </div>
-                """, 
+                _RESULT_CARD_TPL.format_map({
+                    "cls": "continue-true" if continue_conv else "continue-false",
+                    "head": "✅ 会話継続" if continue_conv else "🛑 会話完了",
+                    "ack": parsed_result.get("acknowledgement", "なし"),
+                    "reason": parsed_result.get("reason", "なし"),
+                    "method": parsed_result.get("method", "なし"),
+                }),
                 unsafe_allow_html=True
             )
             
             # バックアップヒューリスティックと比較
             with st.expander("ヒューリスティック比較"):
-                backup_continue = st.session_state.backup_result.get("continueConversation", False)
+                backup_continue = backup_result.get("continueConversation", False)
                 agreement = backup_continue == continue_conv
                 
                 st.markdown(
-                    f"""
-                    <div class="result-card comparison-card">
-                        <h4>{'✓ 一致' if agreement else '✗ 不一致'}</h4>
-                        <p><strong>ヒューリスティック判定:</strong> {'会話継続' if backup_continue else '会話完了'}</p>
-                        <p><strong>理由:</strong> {st.session_state.backup_result.get('reason', 'なし')}</p>
-                    </div>
-                    """,
+                    _COMPARISON_CARD_TPL.format_map({
+                        "head": "✓ 一致" if agreement else "✗ 不一致",
+                        "verdict": "会話継続" if backup_continue else "会話完了",
+                        "reason": backup_result.get("reason", "なし"),
+                    }),
                     unsafe_allow_html=True
                 )
             
@@ -310,33 +448,42 @@ def main():
             with st.expander("生の応答"):
                 st.code(st.session_state.raw_response)
             
-            # 履歴
+            # 履歴（上限つきdeque: 追記はO(1)で、あふれた分は自動で落ちる）
             if "history" not in st.session_state:
-                st.session_state.history = []
+                st.session_state.history = deque(maxlen=_HISTORY_MAX)
+            history = st.session_state.history
             
-            # 現在の結果を履歴に追加（新しい場合）
+            # 現在の結果を履歴に追加（新しい場合）。カードHTMLは追加時に
+            # 一度だけ組み立ててエスケープしておく。再実行のたびに全カードを
+            # 再構築・再エスケープせず、入力をそのまま埋め込むXSSも防ぐ
+            continue_val = continue_conv
+            current_input = st.session_state.user_input
             current_entry = {
-                "input": st.session_state.user_input,
-                "result": st.session_state.parsed_result
+                "input": current_input,
+                "result": parsed_result,
+                "html": (
+                    f'<div style="margin-bottom:10px; padding:5px; '
+                    f'border-left:3px solid {"green" if continue_val else "red"}">'
+                    f'<strong>{"会話継続" if continue_val else "会話完了"}:</strong> '
+                    f'{html.escape(current_input)}</div>'
+                ),
             }
             
-            # 最新のエントリでない場合のみ追加
-            if not st.session_state.history or st.session_state.history[-1]["input"] != current_entry["input"]:
-                st.session_state.history.append(current_entry)
+            # 最新のエントリでない場合のみ追加（dequeの[-1]はO(1)）
+            if not history or history[-1]["input"] != current_entry["input"]:
+                history.append(current_entry)
             
-            # 履歴の表示
-            if st.session_state.history:
+            # 履歴の表示（末尾スライスのリスト複製を作らず、逆順イテレータを
+            # そのまま表示件数で打ち切って1回のmarkdownで描画する）
+            if history:
                 with st.expander("履歴", expanded=True):
-                    for i, entry in enumerate(reversed(st.session_state.history[-10:])):
-                        continue_val = entry["result"].get("continueConversation", False)
-                        st.markdown(
-                            f"""
-                            <div style="margin-bottom:10px; padding:5px; border-left:3px solid {'green' if continue_val else 'red'}">
-                                <strong>{"会話継続" if continue_val else "会話完了"}:</strong> {entry["input"]}
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
+                    st.markdown(
+                        "".join(
+                            entry["html"]
+                            for entry in islice(reversed(history), _HISTORY_SHOWN)
+                        ),
+                        unsafe_allow_html=True
+                    )
         else:
             st.info("入力テキストを入力して「判定テスト」ボタンをクリックしてください。")
     
@@ -0,0 +1,89 @@
+"""
+ターン判定応答の解析ヘルパー
+
+test_speech.py と test_llm_speech.py に重複していたJSON解析と
+フォールバック処理をここに集約する。正規表現はモジュール読み込み時に
+一度だけコンパイルし、orjsonがあればCパーサでデコードする。
+"""
+import json
+import re
+
+try:
+    import orjson  # ターン判定JSONの高速なパースに使用
+except ImportError:
+    orjson = None  # orjsonが無い環境では標準ライブラリのjsonにフォールバック
+
+# JSONが壊れていた場合のフォールバック抽出用
+_CONT_RE = re.compile(r'continueConversation"\s*:\s*(true|false)')
+_ACK_RE = re.compile(r'acknowledgement":\s*"([^"]+)')
+
+
+def _json_loads(s):
+    """orjsonがあればCパーサでデコードする（無ければ標準のjson）"""
+    return orjson.loads(s) if orjson is not None else json.loads(s)
+
+
+def find_json_span(text):
+    """
+    テキストから最初のJSONオブジェクトを1回の走査で切り出す
+
+    DOTALL付きの{.*}はネストした波括弧で後戻りが膨らむため、波括弧の深さを
+    数えて対応する閉じ括弧を探す。文字列リテラル内の括弧とエスケープも考慮する。
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def parse_turn_response(text, default_continue=True, default_ack="なるほど"):
+    """
+    ターン判定LLMの応答から (会話継続か, 相槌, 解析成功か) を取り出す
+
+    モデルは指示通り純粋なJSONを返すことが多いので、まず全文をそのまま
+    パースし、失敗したときだけJSON部分の切り出しに落とす。JSONとして
+    解釈できなければ正規表現でフィールドだけ拾う（この場合は3要素目が
+    Falseになり、呼び出し側はキャッシュしない）。
+    """
+    turn_data = None
+    try:
+        turn_data = _json_loads(text)
+    except ValueError:
+        json_str = find_json_span(text)
+        if json_str:
+            try:
+                turn_data = _json_loads(json_str)
+            except ValueError:
+                turn_data = None
+
+    if turn_data is not None:
+        continue_conversation = turn_data.get("continueConversation", default_continue)
+        ack = turn_data.get("acknowledgement", default_ack)
+        return continue_conversation, ack, True
+
+    cont_match = _CONT_RE.search(text)
+    continue_conversation = (cont_match.group(1) == "true") if cont_match else default_continue
+    ack_match = _ACK_RE.search(text)
+    ack = ack_match.group(1) if ack_match else default_ack
+    return continue_conversation, ack, False
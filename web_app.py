@@ -6,6 +6,8 @@ import time
 import threading
 import queue
 import json
+from collections import deque
+from itertools import zip_longest
 from typing import List, Dict, Any
 
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context
@@ -14,7 +16,7 @@ import numpy as np
 from dotenv import load_dotenv
 
 from speech_to_text import SpeechToTextStreaming
-from llm_manager import LLMManager
+from llm_manager import LLMManager, LLM_TIMEOUT_MESSAGE
 
 # 環境変数の読み込み
 load_dotenv()
@@ -25,8 +27,11 @@ app = Flask(__name__)
 stt = None
 llm = None
 is_listening = False
-transcripts = []
-responses = []
+# 履歴は上限つきのdequeで持つ。長時間のセッションでもメモリが一定で、
+# 追記はO(1)、あふれた分は古いものから自動で落ちる
+_HISTORY_MAX = 500
+transcripts = deque(maxlen=_HISTORY_MAX)
+responses = deque(maxlen=_HISTORY_MAX)
 current_transcript = ""
 transcript_queue = queue.Queue()
 response_thread = None
@@ -44,6 +49,34 @@ CONVERSATION_SYSTEM_PROMPT = """
 返答は簡潔で自然な会話調にしてください。
 """
 
+BATCH_SYSTEM_PROMPT = """
+あなたは会話の相手です。複数のユーザー発言がJSON配列で渡されます。
+各発言に対して返答を作り、以下のJSON配列のみで出力してください。他の説明は一切不要です。
+[{"id": 0, "response": "発言0への返答"}, {"id": 1, "response": "発言1への返答"}]
+
+- 発言が10文字未満の場合: 「なるほど」「そうですね」などの1〜3語の短い相槌
+- それ以外の場合: 自然な会話を続ける簡潔な返答
+"""
+
+# 1回のLLM呼び出しに相乗りさせる文字起こしの上限と、追加分を待つ時間
+_BATCH_MAX = 8
+_BATCH_WINDOW_SEC = 0.05
+
+# ごく短い発言への定型相槌。この長さ以下の発言（「はい」「え？」など）は
+# LLMに聞いても相槌の質がほぼ変わらないため、API往復を払わず即答する
+_SHORT_ACK_MAX_LEN = 4
+_SHORT_ACKS = ("なるほど", "そうですね", "はい", "ええ")
+
+# SSE購読者（クライアントごとのキュー）。状態が進んだときだけプッシュする
+_sse_subscribers = set()
+_sse_lock = threading.Lock()
+
+def _publish_sse(data):
+    """全SSE購読者へイベントを配る（購読者がいなければ何もしない）"""
+    with _sse_lock:
+        for subscriber in _sse_subscribers:
+            subscriber.put(data)
+
 def initialize_stt():
     """
     Speech-to-Textの初期化
@@ -85,11 +118,77 @@ def on_speech_result(transcript, is_final):
     
     # 現在の文字起こしを更新
     current_transcript = transcript
+    _publish_sse({
+        "is_listening": is_listening,
+        "current_transcript": transcript,
+        "transcript_changed": True,
+    })
     
-    # 最終結果の場合はキューに追加
+    # 最終結果の場合はキューに追加するだけ（履歴への記帳はワーカーが行う。
+    # gRPCコールバックをO(1)のままにし、transcriptsの書き手を1本化して
+    # /api/historyの読み取りと競合しないようにする）
     if is_final and transcript.strip():
-        transcript_queue.put(transcript)
-        transcripts.append(transcript)
+        transcript_queue.put_nowait(transcript)
+
+def _generate_response(transcript):
+    """1件の文字起こしに対する応答を生成する"""
+    # ごく短い発言はLLMを呼ばず定型相槌で即答する（長さで機械的に選び、
+    # 同じ相槌ばかりにならない程度の揺らぎをつける）
+    stripped = transcript.strip()
+    if len(stripped) <= _SHORT_ACK_MAX_LEN:
+        return _SHORT_ACKS[len(stripped) % len(_SHORT_ACKS)]
+    
+    # 文字数に基づいて相槌か会話かを判断
+    if len(transcript) < 10:  # 短い発言は相槌
+        system_prompt = AIZUCHI_SYSTEM_PROMPT
+    else:  # 長い発言は会話
+        system_prompt = CONVERSATION_SYSTEM_PROMPT
+    
+    response = llm.call_model(
+        prompt=transcript,
+        system_prompt=system_prompt,
+        model="gemini-2.0-flash",
+        timeout=5.0,
+        fallbacks=("gemini-2.0-flash-lite",),
+        # プロンプトは単発の発話そのもの（履歴を含まない）なので、
+        # 表記揺れ程度の近い発話に同じ応答を返してよい
+        use_semantic_cache=True
+    )
+    if response == LLM_TIMEOUT_MESSAGE:
+        # 全モデルが時間切れ: ワーカーを止めず固定の相槌で場をつなぐ
+        return "なるほど"
+    return response
+
+def _generate_batch_responses(batch):
+    """
+    複数の文字起こしを1回のLLM呼び出しでまとめて処理する
+
+    HTTP往復とプリフィルのオーバーヘッドを件数で割れるので、キューに
+    滞留が出たときのp95レイテンシが下がる。応答のJSON配列が壊れていたり
+    件数が合わない場合は1件ずつの呼び出しにフォールバックする。
+    """
+    prompt = json.dumps(
+        [{"id": i, "text": t} for i, t in enumerate(batch)],
+        ensure_ascii=False
+    )
+    try:
+        raw = llm.call_model(
+            prompt=prompt,
+            system_prompt=BATCH_SYSTEM_PROMPT,
+            model="gemini-2.0-flash",
+            timeout=5.0,
+            fallbacks=("gemini-2.0-flash-lite",)
+        )
+        start = raw.find("[")
+        end = raw.rfind("]")
+        items = json.loads(raw[start:end + 1]) if start != -1 and end > start else None
+        if items is not None:
+            by_id = {item.get("id"): item.get("response", "") for item in items}
+            if all(i in by_id for i in range(len(batch))):
+                return [by_id[i] for i in range(len(batch))]
+    except Exception as e:
+        print(f"バッチ応答の生成に失敗しました（1件ずつ処理します）: {str(e)}")
+    return [_generate_response(t) for t in batch]
 
 def process_transcripts():
     """
@@ -99,35 +198,55 @@ def process_transcripts():
     
     while is_listening:
         try:
-            # キューから文字起こしを取得
-            if not transcript_queue.empty():
-                transcript = transcript_queue.get(timeout=0.1)
-                
-                # 文字数に基づいて相槌か会話かを判断
-                if len(transcript) < 10:  # 短い発言は相槌
-                    system_prompt = AIZUCHI_SYSTEM_PROMPT
-                else:  # 長い発言は会話
-                    system_prompt = CONVERSATION_SYSTEM_PROMPT
-                
-                # LLMで応答を生成
-                response = llm.call_model(
-                    prompt=transcript,
-                    system_prompt=system_prompt,
-                    model="gemini-2.0-flash"
-                )
-                
-                # 応答を保存
-                responses.append(response)
+            # キューが空の間はブロックして休眠する（empty()ポーリングと
+            # 100ms睡眠は、発言ごとに最大100msの遅れと常時CPU消費になる）。
+            # timeoutはis_listeningの変化を拾うための目覚ましでしかない
+            transcript = transcript_queue.get(timeout=0.5)
+            
+            # 短い待ち合わせ窓で後続の文字起こしを相乗りさせる。
+            # 滞留がなければ窓はすぐ空振りし、1件のまま処理される
+            batch = [transcript]
+            deadline = time.monotonic() + _BATCH_WINDOW_SEC
+            while len(batch) < _BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(transcript_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
             
-            # 少し待機
-            time.sleep(0.1)
+            # 履歴への記帳（このスレッドだけがtranscriptsへ書く）
+            transcripts.extend(batch)
+            
+            # LLMで応答を生成して保存
+            if len(batch) == 1:
+                responses.append(_generate_response(batch[0]))
+            else:
+                responses.extend(_generate_batch_responses(batch))
+            _publish_sse({
+                "is_listening": is_listening,
+                "current_transcript": current_transcript,
+                "new_response": responses[-1],
+            })
         except queue.Empty:
-            # キューが空の場合は少し待機
-            time.sleep(0.1)
+            continue
         except Exception as e:
             print(f"文字起こしの処理中にエラーが発生しました: {str(e)}")
             break
 
+def _warmup_llm():
+    """システムプロンプトを1度流してプロバイダ側のキャッシュを温める"""
+    try:
+        llm.call_model(
+            prompt="こんにちは",
+            system_prompt=AIZUCHI_SYSTEM_PROMPT,
+            model="gemini-2.0-flash"
+        )
+    except Exception as e:
+        # ウォームアップは失敗しても機能に影響しない
+        print(f"LLMウォームアップに失敗しました: {str(e)}")
+
 def start_listening():
     """
     音声認識を開始する
@@ -149,6 +268,11 @@ def start_listening():
         print("初期化に失敗しました。")
         return
     
+    # 最初の発言でコールドスタート（TLS/HTTP2確立とプロバイダ側の
+    # プレフィックスキャッシュのプレフィル）を払わないよう、裏で一度だけ
+    # 小さなウォームアップ呼び出しを流しておく
+    threading.Thread(target=_warmup_llm, daemon=True).start()
+    
     # 音声認識を開始
     stt.start_listening(callback=on_speech_result)
     is_listening = True
@@ -243,15 +367,15 @@ def api_history():
     """
     history = []
     
-    # 会話履歴を作成
-    for i in range(max(len(transcripts), len(responses))):
+    # 会話履歴を作成（dequeの添字アクセスはO(n)なのでまとめて走査する）
+    for transcript, response in zip_longest(transcripts, responses):
         item = {}
         
-        if i < len(transcripts):
-            item["transcript"] = transcripts[i]
+        if transcript is not None:
+            item["transcript"] = transcript
         
-        if i < len(responses):
-            item["response"] = responses[i]
+        if response is not None:
+            item["response"] = response
         
         history.append(item)
     
@@ -263,27 +387,27 @@ def api_stream():
     SSEを使用して状態をストリーミングするAPI
     """
     def generate():
-        last_transcript = ""
-        last_response_count = 0
+        # 500msポーリングではなくイベント駆動でプッシュする。状態が
+        # 進んだ瞬間に配信され、何も起きなければ何も送らない
+        client_queue = queue.Queue()
+        with _sse_lock:
+            _sse_subscribers.add(client_queue)
         
-        while True:
-            data = {
-                "is_listening": is_listening,
-                "current_transcript": current_transcript
-            }
-            
-            # 新しい応答があれば追加
-            if len(responses) > last_response_count:
-                data["new_response"] = responses[-1]
-                last_response_count = len(responses)
-            
-            # 文字起こしが変わったら更新
-            if current_transcript != last_transcript:
-                data["transcript_changed"] = True
-                last_transcript = current_transcript
+        try:
+            # 接続直後に現在の状態を1度送る
+            yield f"data: {json.dumps({'is_listening': is_listening, 'current_transcript': current_transcript})}\n\n"
             
-            yield f"data: {json.dumps(data)}\n\n"
-            time.sleep(0.5)
+            while True:
+                try:
+                    data = client_queue.get(timeout=15)
+                except queue.Empty:
+                    # 接続維持用のコメントフレーム（プロキシのタイムアウト対策）
+                    yield ":keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(data)}\n\n"
+        finally:
+            with _sse_lock:
+                _sse_subscribers.discard(client_queue)
     
     return Response(stream_with_context(generate()), mimetype="text/event-stream")
 